@@ -0,0 +1,4 @@
+'''Fast many-to-many fuzzy matching built on FuzzyWuzzy scorers.'''
+from .matching import match_columns, match_with_confidence, prepare_scorer
+
+__all__ = ['match_columns', 'match_with_confidence', 'prepare_scorer']
@@ -0,0 +1,156 @@
+'''One-to-one matching: no two queries get the same choice.
+
+`match_columns` picks the best choice of every query on its own, so two
+employees can both be given the same username. Here the top-k candidates of
+every query form a sparse bipartite graph weighted by similarity, and the
+one-to-one mapping with the largest total similarity is picked instead.
+
+The graph is split into connected components, which are independent, and
+each is solved by the cheapest method that fits it:
+
+* `hungarian`: up to `hungarian_limit` nodes (queries plus choices), exactly,
+  on the dense score matrix (`scipy.optimize.linear_sum_assignment`);
+* `sparse`: up to `sparse_limit` edges, exactly, on the sparse graph
+  (`scipy.sparse.csgraph.min_weight_full_bipartite_matching`), in memory
+  linear in the number of edges but in time that grows faster;
+* `greedy`: beyond that, best edge first, in O(E log E).
+
+With blocked candidates most components are small, but similar names can
+chain into a giant one: on 10^5 synthetic employees and their top-5
+candidates the whole graph is one component, solved exactly in about 50
+seconds or greedily in under one.
+'''
+import numpy as np
+import pandas as pd
+
+from . import profiling
+from .matching import _as_series, match_columns
+
+
+def _hungarian(rows, cols, scores):
+    '''Edge positions of a maximum-weight matching of one component.'''
+    from scipy.optimize import linear_sum_assignment
+
+    row_nodes, r = np.unique(rows, return_inverse=True)
+    col_nodes, c = np.unique(cols, return_inverse=True)
+    matrix = np.zeros((len(row_nodes), len(col_nodes)))
+    edge = np.full((len(row_nodes), len(col_nodes)), -1, dtype=np.intp)
+    matrix[r, c] = scores
+    edge[r, c] = np.arange(len(rows))
+    picked_rows, picked_cols = linear_sum_assignment(matrix, maximize=True)
+    picked = edge[picked_rows, picked_cols]
+    # The solver fills its square part with non-edges when it has to
+    return picked[picked >= 0]
+
+
+def _sparse(rows, cols, scores):
+    '''Edge positions of a maximum-weight matching of one component, kept sparse.'''
+    from scipy.sparse import csr_matrix
+    from scipy.sparse.csgraph import min_weight_full_bipartite_matching
+
+    row_nodes, r = np.unique(rows, return_inverse=True)
+    col_nodes, c = np.unique(cols, return_inverse=True)
+    n, m = len(row_nodes), len(col_nodes)
+    # A private dummy column per row (leaving it unmatched) makes a full
+    # matching exist; costs stay positive since the solver drops zeros
+    top = scores.max() + 1
+    graph = csr_matrix((np.r_[top - scores, np.full(n, top)],
+                        (np.r_[r, np.arange(n)], np.r_[c, m + np.arange(n)])), shape=(n, m + n))
+    matched_rows, matched_cols = min_weight_full_bipartite_matching(graph)
+    real = matched_cols < m
+    keys = r * m + c
+    order = np.argsort(keys)
+    return order[np.searchsorted(keys[order], matched_rows[real] * m + matched_cols[real])]
+
+
+def _greedy(rows, cols, scores):
+    '''Edge positions picked best first, ties to the lowest row then column.'''
+    taken_rows, taken_cols, picked = set(), set(), []
+    for e in np.lexsort((cols, rows, -scores)):
+        if rows[e] not in taken_rows and cols[e] not in taken_cols:
+            taken_rows.add(rows[e])
+            taken_cols.add(cols[e])
+            picked.append(e)
+    return np.array(picked, dtype=np.intp)
+
+
+def assign(rows, cols, scores, hungarian_limit=1000, sparse_limit=200000):
+    '''One-to-one matching of the distinct weighted edges (rows[i], cols[i], scores[i]).
+
+    `rows` and `cols` are node numbers on each side. Returns the positions
+    of the picked edges, the component of every edge and the method that
+    solved each component, in the order of their numbers.
+    '''
+    from scipy.sparse import coo_matrix
+    from scipy.sparse.csgraph import connected_components
+
+    rows, cols = np.asarray(rows, dtype=np.intp), np.asarray(cols, dtype=np.intp)
+    scores = np.asarray(scores, dtype=np.float64)
+    n_rows = rows.max() + 1 if len(rows) else 0
+    n_cols = cols.max() + 1 if len(cols) else 0
+
+    with profiling.stage('components'):
+        # Rows are nodes 0..n_rows-1, columns come after them
+        graph = coo_matrix((np.ones(len(rows)), (rows, cols + n_rows)),
+                           shape=(n_rows + n_cols,) * 2)
+        _, labels = connected_components(graph, directed=False)
+        component = labels[rows]
+        order = np.argsort(component, kind='stable')
+        bounds = np.flatnonzero(np.r_[True, np.diff(component[order]) != 0, True])
+
+    picked, methods = [], []
+    with profiling.stage('assign'):
+        for start, stop in zip(bounds[:-1], bounds[1:]):
+            edges = order[start:stop]
+            if len(edges) == 1:
+                picked.append(edges)
+                methods.append('hungarian')
+                continue
+            nodes = len(np.unique(rows[edges])) + len(np.unique(cols[edges]))
+            if nodes <= hungarian_limit:
+                method, solve = 'hungarian', _hungarian
+            elif len(edges) <= sparse_limit:
+                method, solve = 'sparse', _sparse
+            else:
+                method, solve = 'greedy', _greedy
+            picked.append(edges[solve(rows[edges], cols[edges], scores[edges])])
+            methods.append(method)
+    picked = np.sort(np.concatenate(picked)) if picked else np.empty(0, dtype=np.intp)
+    return picked, component, np.array(methods, dtype=object)
+
+
+def one_to_one_match(left, right, top_k=5, slack=None, hungarian_limit=1000,
+                     sparse_limit=200000, **kwargs):
+    '''Match every row of `left` to a distinct choice of `right`.
+
+    The candidates are the `top_k` best choices of each row found by
+    `match_columns(**kwargs)` (so an `index` keeps the graph sparse and a
+    `score_cutoff` drops weak edges); with `slack`, those more than `slack`
+    points below the row's best are dropped too. Among them, the one-to-one
+    mapping with the largest total similarity is returned, indexed like
+    `left`, with the `rank` the assigned choice had among the row's own
+    candidates (0 when the row got its own best match), the `component` the
+    row belongs to and the `method` that solved it. Rows left without a
+    choice are dropped.
+    '''
+    left = _as_series(left)
+    matches = match_columns(left.reset_index(drop=True), right, top_k=top_k, **kwargs)
+    if slack is not None and len(matches):
+        best = matches.groupby(level=0)['similarity'].transform('max')
+        matches = matches[matches['similarity'] >= best - slack]
+    columns = ['match', 'similarity', 'choice_index', 'rank', 'component', 'method']
+    if len(matches) == 0:
+        return pd.DataFrame(columns=columns)
+
+    rows = matches.index.to_numpy(dtype=np.intp)
+    cols, _ = pd.factorize(matches['choice_index'])
+    picked, component, methods = assign(rows, cols, matches['similarity'].to_numpy(),
+                                        hungarian_limit, sparse_limit)
+
+    result = matches.iloc[picked].copy()
+    # Components numbered 0.. in the order `methods` lists them
+    number = np.searchsorted(np.unique(component), component[picked])
+    result['component'] = number
+    result['method'] = methods[number]
+    result.index = left.index[result.index.to_numpy(dtype=np.intp)]
+    return result[columns]
@@ -0,0 +1,236 @@
+'''Benchmarks of the matching pipeline on synthetic data of any size.
+
+`run` generates `rows` employees with `synthetic.generate` and times:
+
+* the exact-match pass on the generated emails (all rows);
+* the `process.extract` loop the notebook started from (`extract_sample`
+  queries, since it scores every choice in pure Python);
+* every scorer of `scorer_dict` through `match_columns` with n-gram blocking
+  (`sample` queries against all the choices);
+* the token ratios on pairs of long documents.
+
+Each stage records its time, throughput, accuracy against the known true
+username where there is one, and `peak_mb`: the most memory it allocated on
+top of what was already in use, traced by `tracemalloc` (which slows every
+stage down a little, equally across runs). The run records the peak
+resident memory of the whole process as `rss_peak_mb`. A run is appended to a JSON history together with the commit
+it ran on, so two commits can be compared with `compare`:
+
+    python -m fuzzy_match.bench run --rows 100000
+    python -m fuzzy_match.bench compare
+'''
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+from fuzzywuzzy import fuzz, process
+
+from .blocking import NGramIndex
+from .matching import match_columns
+from .pipeline import exact_match
+from .scorers import SCORERS
+from .synthetic import DOMAIN, documents, generate
+
+
+HISTORY = 'bench_history.json'
+
+LONG_TEXT_SCORERS = {'R': fuzz.ratio, 'PR': fuzz.partial_ratio,
+                     'TSoR': fuzz.token_sort_ratio, 'TSeR': fuzz.token_set_ratio}
+
+
+def _rss_peak_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Bytes on macOS, kilobytes elsewhere
+    return peak / 2 ** 20 if sys.platform == 'darwin' else peak / 2 ** 10
+
+
+def _commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class _Stage:
+    '''Times a block of work and stores its record in `stages`.'''
+
+    def __init__(self, stages, name, items):
+        self.stages = stages
+        self.name = name
+        self.items = items
+        self.accuracy = None
+
+    def __enter__(self):
+        tracemalloc.reset_peak()
+        self.memory = tracemalloc.get_traced_memory()[0]
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        seconds = time.perf_counter() - self.start
+        peak = tracemalloc.get_traced_memory()[1] - self.memory
+        if exc_info[0] is None:
+            self.stages[self.name] = {
+                'seconds': seconds, 'items': self.items,
+                'per_second': self.items / seconds if seconds else None,
+                'accuracy': self.accuracy, 'peak_mb': peak / 2 ** 20}
+
+
+def _accuracy(matches, truth):
+    found = matches['match'].reindex(range(len(truth)))
+    return float((found.to_numpy() == np.asarray(truth)).mean())
+
+
+def run(rows=10000, sample=200, extract_sample=5, limit=50, scorers=SCORERS,
+        long_texts=20, words=350, seed=0):
+    '''Run every benchmark stage once and return the record of the run.'''
+    tracing = tracemalloc.is_tracing()
+    if not tracing:
+        tracemalloc.start()
+    try:
+        stages = _run_stages(rows, sample, extract_sample, limit, scorers, long_texts,
+                             words, seed)
+    finally:
+        if not tracing:
+            tracemalloc.stop()
+    return {'commit': _commit(), 'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'params': {'rows': rows, 'sample': sample, 'extract_sample': extract_sample,
+                       'limit': limit, 'long_texts': long_texts, 'words': words,
+                       'seed': seed},
+            'rss_peak_mb': _rss_peak_mb(), 'stages': stages}
+
+
+def _run_stages(rows, sample, extract_sample, limit, scorers, long_texts, words, seed):
+    stages = {}
+    with _Stage(stages, 'generate', rows):
+        hr, it = generate(rows, seed)
+
+    gen_email = (hr['full_name'].str[0] + '.' + hr['full_name'].str.split().str[-1]
+                 + DOMAIN).str.lower()
+    with _Stage(stages, 'exact', rows) as stage:
+        found = exact_match(gen_email, it['email'])
+        hit = found.notna().to_numpy()
+        stage.accuracy = float((it['username'].to_numpy()[found[hit].astype(np.intp)]
+                                == hr['username'].to_numpy()[hit]).sum() / rows)
+
+    rng = np.random.default_rng(seed)
+    picked = np.sort(rng.choice(rows, size=min(sample, rows), replace=False))
+    queries = hr['full_name'].iloc[picked].reset_index(drop=True)
+    truth = hr['username'].iloc[picked].to_numpy()
+
+    with _Stage(stages, 'extract', min(extract_sample, len(queries))) as stage:
+        best = [process.extract(q, it['username'], limit=1)[0][0]
+                for q in queries[:extract_sample]]
+        stage.accuracy = float((np.array(best, dtype=object)
+                                == truth[:len(best)]).mean())
+
+    with _Stage(stages, 'blocking_index', rows):
+        index = NGramIndex(it['username'], limit=limit)
+    for name, scorer in scorers.items():
+        with _Stage(stages, 'match_columns/' + name, len(queries)) as stage:
+            matches = match_columns(queries, it['username'], scorer=scorer, index=index)
+            stage.accuracy = _accuracy(matches, truth)
+
+    texts = documents(2 * long_texts, words, seed)
+    for name, scorer in LONG_TEXT_SCORERS.items():
+        with _Stage(stages, 'long_text/' + name, long_texts):
+            for a, b in zip(texts[::2], texts[1::2]):
+                scorer(a, b)
+    return stages
+
+
+def load_history(path=HISTORY):
+    if not os.path.exists(path):
+        return []
+    with open(path) as f:
+        return json.load(f)
+
+
+def record(run_record, path=HISTORY):
+    '''Append a run to the JSON history at `path`.'''
+    history = load_history(path) + [run_record]
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(history, f, indent=1)
+    os.replace(tmp, path)
+    return history
+
+
+def compare(old, new):
+    '''Stage by stage differences between two run records.
+
+    `change` is new / old for the time and memory, and new - old for the
+    accuracy. Runs with different `params` are not comparable and raise a
+    ValueError.
+    '''
+    if old['params'] != new['params']:
+        raise ValueError('runs with different params: %r and %r'
+                         % (old['params'], new['params']))
+    rows = []
+    for stage in sorted(set(old['stages']) | set(new['stages'])):
+        a, b = old['stages'].get(stage, {}), new['stages'].get(stage, {})
+        for metric in ('seconds', 'accuracy', 'peak_mb'):
+            x, y = a.get(metric), b.get(metric)
+            if x is None and y is None:
+                continue
+            if x is None or y is None:
+                change = None
+            elif metric == 'accuracy':
+                change = y - x
+            else:
+                change = y / x if x else None
+            rows.append((stage, metric, x, y, change))
+    return pd.DataFrame(rows, columns=['stage', 'metric', 'old', 'new', 'change'])
+
+
+def _find(history, ref):
+    if ref is None:
+        return None
+    try:
+        return history[int(ref)]
+    except ValueError:
+        pass
+    for run_record in reversed(history):
+        if run_record['commit'] and run_record['commit'].startswith(ref):
+            return run_record
+    raise KeyError('no run of commit %s in the history' % ref)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('command', choices=['run', 'compare'])
+    parser.add_argument('--history', default=HISTORY)
+    parser.add_argument('--rows', type=int, default=10000)
+    parser.add_argument('--sample', type=int, default=200)
+    parser.add_argument('--extract-sample', type=int, default=5)
+    parser.add_argument('--limit', type=int, default=50)
+    parser.add_argument('--long-texts', type=int, default=20)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--old', help='run to compare from: commit or history position '
+                                      '(default: the one before --new)')
+    parser.add_argument('--new', help='run to compare to (default: the last one)')
+    args = parser.parse_args(argv)
+
+    if args.command == 'run':
+        run_record = run(args.rows, args.sample, args.extract_sample, args.limit,
+                         long_texts=args.long_texts, seed=args.seed)
+        record(run_record, args.history)
+        stages = pd.DataFrame(run_record['stages']).T
+        print(stages.to_string())
+    else:
+        history = load_history(args.history)
+        new = _find(history, args.new) or history[-1]
+        old = _find(history, args.old) or history[history.index(new) - 1]
+        print(compare(old, new).to_string(index=False))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+'''Candidate blocking so a query is only scored against plausible choices.
+
+Nearly every (full_name, username) pair in the hr/it matching is hopeless:
+'Kortney Lapierre Brazee' has nothing in common with 'l.kane'. An
+`NGramIndex` is built once over the choice column and returns, for each query,
+the `limit` choices sharing the most character n-grams with it. Only those are
+handed to the (expensive) scorer.
+'''
+import time
+
+import numpy as np
+from fuzzywuzzy import fuzz, utils
+
+from .matching import _as_series, match_columns
+
+
+class NGramIndex:
+    '''Character n-gram inverted index over a choice column.
+
+    `limit` is the recall-vs-speed knob: the number of candidates per query
+    that survive blocking. Raising it scores more pairs and loses fewer
+    matches; `limit=None` keeps every choice sharing at least one n-gram.
+    '''
+
+    def __init__(self, choices, n=3, limit=200, processor=utils.full_process):
+        self.n = n
+        self.limit = limit
+        self.processor = processor
+        self.size = len(choices)
+
+        postings = {}
+        for position, choice in enumerate(choices):
+            for gram in self.grams(choice):
+                postings.setdefault(gram, []).append(position)
+        self.postings = {gram: np.array(positions, dtype=np.int64)
+                         for gram, positions in postings.items()}
+
+    def grams(self, s):
+        '''Set of padded character n-grams of the processed string.'''
+        s = ' %s ' % self.processor(s)
+        return {s[i:i + self.n] for i in range(len(s) - self.n + 1)}
+
+    def candidates(self, query, limit=None):
+        '''Sorted positions of the choices sharing the most n-grams with query.'''
+        limit = self.limit if limit is None else limit
+        hits = [self.postings[g] for g in self.grams(query) if g in self.postings]
+        return top_candidates(hits, self.size, limit)
+
+
+def top_candidates(hits, size, limit, deleted=None):
+    '''Sorted positions appearing most often in the `hits` posting lists.
+
+    At most `limit` positions are kept (all of them for None); positions
+    flagged in the boolean `deleted` array are skipped.
+    '''
+    if not hits:
+        return np.empty(0, dtype=np.int64)
+    counts = np.bincount(np.concatenate(hits), minlength=size)
+    if deleted is not None:
+        counts[deleted] = 0
+    found = np.flatnonzero(counts)
+    if limit is not None and len(found) > limit:
+        best = np.argpartition(-counts[found], limit - 1)[:limit]
+        found = np.sort(found[best])
+    return found
+
+
+def blocking_recall(left, right, index, scorer=fuzz.WRatio, truth=None):
+    '''Report how many matches blocking loses compared to scoring everything.
+
+    Without `truth` a row is lost when blocking drops it or finds a lower
+    score than the exhaustive best match of `scorer` (ties to another
+    choice are not lost); otherwise `truth` holds the expected index label
+    of `right` for every row of `left`.
+    '''
+    left, right = _as_series(left), _as_series(right)
+
+    start = time.perf_counter()
+    blocked = match_columns(left, right, scorer=scorer, index=index)
+    blocked_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    exhaustive = match_columns(left, right, scorer=scorer)
+    exhaustive_time = time.perf_counter() - start
+
+    if truth is None:
+        found = blocked['similarity'].reindex(left.index).to_numpy(dtype=np.float64)
+        best = exhaustive['similarity'].reindex(left.index).to_numpy(dtype=np.float64)
+        # NaN (dropped by blocking) compares False, so counts as lost
+        lost = int((~(found >= best) & ~np.isnan(best)).sum())
+    else:
+        found = blocked['choice_index'].reindex(left.index)
+        lost = int((found.to_numpy() != _as_series(truth).reindex(left.index).to_numpy()).sum())
+    candidates = sum(len(index.candidates(q)) for q in left)
+
+    return {
+        'queries': len(left),
+        'lost': lost,
+        'recall': 1 - lost / len(left) if len(left) else 1.0,
+        'candidates_per_query': candidates / len(left) if len(left) else 0.0,
+        'blocked_seconds': blocked_time,
+        'exhaustive_seconds': exhaustive_time,
+    }
@@ -0,0 +1,137 @@
+'''Upper bounds on ratio scores, used to skip hopeless candidates.
+
+`fuzz.ratio` is 2*M / (len1 + len2) where M, the number of matching
+characters, can be neither larger than the shorter string nor larger than
+the overlap of the two character histograms. `partial_ratio` compares the
+shorter string with windows of the longer one and obeys the same kind of
+bound. Both are far cheaper than the full comparison and are computed for
+all choices at once with NumPy, so a top-k search can visit the candidates
+with the best bound first and stop as soon as no remaining candidate can
+beat the k-th best score found so far.
+'''
+import numpy as np
+from fuzzywuzzy import fuzz
+
+from . import profiling
+
+
+# Scorers with a bound: (compares sorted tokens, is a partial ratio)
+BOUNDED_SCORERS = {
+    fuzz.ratio: (False, False), fuzz.QRatio: (False, False), fuzz.UQRatio: (False, False),
+    fuzz.token_sort_ratio: (True, False),
+    fuzz.partial_ratio: (False, True), fuzz.partial_token_sort_ratio: (True, True),
+}
+
+
+def compared_string(s, sorted_tokens):
+    '''The string the underlying ratio sees for a processed or Prepared string.'''
+    if hasattr(s, 'sorted_tokens'):
+        return s.sorted_tokens if sorted_tokens else s.processed
+    if sorted_tokens:
+        return ' '.join(sorted(s.split())).strip()
+    return s
+
+
+def _codes(s):
+    return np.frombuffer(s.encode('utf-32-le'), dtype=np.uint32)
+
+
+class CharHistograms:
+    '''Character histograms of a list of strings, one row per string.'''
+
+    def __init__(self, strings, joined=None, lengths=None):
+        # `joined` and `lengths` spare the join when the strings are stored
+        # back to back already
+        if joined is None:
+            joined, lengths = ''.join(strings), [len(s) for s in strings]
+        self.lengths = np.asarray(lengths, dtype=np.int64)
+        codes = _codes(joined)
+        self.alphabet, columns = np.unique(codes, return_inverse=True)
+        rows = np.repeat(np.arange(len(self.lengths)), self.lengths)
+        self.counts = np.zeros((len(self.lengths), len(self.alphabet)), dtype=np.uint16)
+        np.add.at(self.counts, (rows, columns), 1)
+
+    @classmethod
+    def from_arrays(cls, alphabet, counts, lengths):
+        '''Histograms from the arrays of another one (e.g. memory-mapped).'''
+        histograms = cls.__new__(cls)
+        histograms.alphabet, histograms.counts, histograms.lengths = alphabet, counts, lengths
+        return histograms
+
+    def histogram(self, s):
+        '''Histogram of `s` over the alphabet (other characters can't match).'''
+        columns = _known(self.alphabet, _codes(s))
+        return np.bincount(columns, minlength=len(self.alphabet))
+
+    def upper_bounds(self, s, positions, partial=False):
+        '''Upper bound of the ratio (or partial ratio) of `s` with each position.'''
+        overlap = np.minimum(self.counts[positions], self.histogram(s)).sum(axis=1)
+        lengths = self.lengths[positions]
+        if partial:
+            shorter = np.minimum(lengths, len(s))
+            matches = np.minimum(overlap, shorter)
+            with np.errstate(invalid='ignore', divide='ignore'):
+                bound = 2.0 * matches / (shorter + matches)
+            bound = np.where(bound > .995, 1.0, bound)
+            bound[shorter == 0] = 1.0
+        else:
+            total = lengths + len(s)
+            with np.errstate(invalid='ignore', divide='ignore'):
+                bound = 2.0 * overlap / total
+            bound[total == 0] = 1.0
+        # Same rounding as utils.intr, which is monotonic so the bound holds
+        return np.round(100 * bound).astype(np.int64)
+
+
+def _known(alphabet, codes):
+    columns = np.searchsorted(alphabet, codes)
+    inside = columns < len(alphabet)
+    columns, codes = columns[inside], codes[inside]
+    return columns[alphabet[columns] == codes]
+
+
+def extract_bounded(query, choices, histograms, score, k, positions,
+                    partial=False, score_cutoff=0, bound_query=None):
+    '''Top-k (position, score) pairs of `query` among `positions` of `choices`.
+
+    Gives the same result as scoring every candidate and keeping the k best
+    (ties to the lowest position) with a score of at least `score_cutoff`,
+    but stops once the bound of the next candidate can't make the top k.
+    `bound_query` is the string the bounds are computed for.
+    '''
+    with profiling.stage('bounds'):
+        bounds = histograms.upper_bounds(bound_query, positions, partial)
+        order = np.lexsort((positions, -bounds))
+
+    with profiling.stage('score'):
+        best, scored = _visit(query, choices, score, k, score_cutoff, bounds, order, positions)
+    profiling.count('comparisons', scored)
+    profiling.count('comparisons_skipped', len(positions) - scored)
+    return best
+
+
+def _visit(query, choices, score, k, score_cutoff, bounds, order, positions):
+    best = []  # (score, position), kept sorted best first
+    scored = 0
+    for i in order:
+        bound, position = bounds[i], positions[i]
+        if bound < score_cutoff:
+            break
+        if len(best) == k:
+            worst_score, worst_position = best[-1]
+            if bound < worst_score or (bound == worst_score and position > worst_position):
+                break
+        s = score(query, choices[position])
+        scored += 1
+        if s < score_cutoff:
+            continue
+        if len(best) == k:
+            worst_score, worst_position = best[-1]
+            if s < worst_score or (s == worst_score and position > worst_position):
+                continue
+            best.pop()
+        at = 0
+        while at < len(best) and (best[at][0] > s or (best[at][0] == s and best[at][1] < position)):
+            at += 1
+        best.insert(at, (s, position))
+    return best, scored
@@ -0,0 +1,240 @@
+'''Persistent choice index, memory-mapped by every job that matches against it.
+
+Building a `ChoiceIndex` processes the choices (e.g. `it.username`) once and
+stores the raw, processed and sorted-token strings as `StringStore`s (UTF-8
+buffers with offset arrays), along with a trigram inverted index for
+blocking and the character histograms of the ratio bounds. Opening it
+memory-maps those arrays: nothing is re-read from CSV or re-processed,
+strings are only decoded when a candidate is scored, and
+worker processes opening the same index share its pages through the OS page
+cache.
+
+Accounts added later go to a new segment (`append`) and removed ones are
+tombstoned (`delete`), so the index is never rebuilt from scratch. Positions
+are stable ids: they are never reused and serve as the `choice_index` of
+the matches. `meta.json` lists the segments and is written last, so an
+interrupted `append` leaves the index as it was.
+'''
+import json
+import os
+import shutil
+
+import numpy as np
+from fuzzywuzzy import fuzz, utils
+
+from .blocking import top_candidates
+from .bounds import CharHistograms, _codes
+from .matching import prepare_scorer
+from .prepared import Prepared, PreparedChoices
+from .store import StringStore
+
+
+_COLUMNS = ('raw', 'processed', 'sorted')
+
+
+def _gram_keys(s):
+    '''Padded trigrams of a processed string packed into uint64 keys.'''
+    codes = _codes(' %s ' % s).astype(np.uint64)
+    keys = (codes[:-2] << np.uint64(42)) | (codes[1:-1] << np.uint64(21)) | codes[2:]
+    return np.unique(keys)
+
+
+def _save(directory, name, array):
+    np.save(os.path.join(directory, name + '.npy'), array)
+
+
+def _load(directory, name):
+    return np.load(os.path.join(directory, name + '.npy'), mmap_mode='r')
+
+
+def _concatenate(histograms):
+    '''CharHistograms of the strings of several CharHistograms, in order.'''
+    if len(histograms) == 1:
+        return histograms[0]
+    alphabet = np.unique(np.concatenate([h.alphabet for h in histograms]))
+    counts = np.zeros((sum(len(h.lengths) for h in histograms), len(alphabet)), dtype=np.uint16)
+    start = 0
+    for h in histograms:
+        counts[start:start + len(h.lengths), np.searchsorted(alphabet, h.alphabet)] = h.counts
+        start += len(h.lengths)
+    return CharHistograms.from_arrays(alphabet, counts,
+                                      np.concatenate([h.lengths for h in histograms]))
+
+
+class _Segment:
+    '''One batch of choices: its strings, trigram postings and character histograms.'''
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.strings = {name: StringStore.open(directory, name) for name in _COLUMNS}
+        self.keys = _load(directory, 'gram_keys')
+        self.indptr = _load(directory, 'gram_indptr')
+        self.postings = _load(directory, 'gram_postings')
+
+    @staticmethod
+    def write(directory, raw, process_choice):
+        os.makedirs(directory)
+        raw = [str(r) for r in raw]
+        processed = [process_choice(r) for r in raw]
+        sorted_tokens = [' '.join(sorted(p.split())).strip() for p in processed]
+        StringStore.from_strings(raw).save(directory, 'raw')
+        StringStore.from_strings(processed).save(directory, 'processed')
+        StringStore.from_strings(sorted_tokens).save(directory, 'sorted')
+        for name, strings in (('processed', processed), ('sorted', sorted_tokens)):
+            histograms = CharHistograms(strings)
+            _save(directory, name + '_alphabet', histograms.alphabet)
+            _save(directory, name + '_counts', histograms.counts)
+            _save(directory, name + '_lengths', histograms.lengths)
+
+        grams = [_gram_keys(utils.full_process(r)) for r in raw]
+        keys = np.concatenate(grams) if grams else np.empty(0, dtype=np.uint64)
+        positions = np.repeat(np.arange(len(raw), dtype=np.int64), [len(g) for g in grams])
+        order = np.argsort(keys, kind='stable')
+        unique, first = np.unique(keys[order], return_index=True)
+        _save(directory, 'gram_keys', unique)
+        _save(directory, 'gram_indptr', np.append(first, len(keys)).astype(np.int64))
+        _save(directory, 'gram_postings', positions[order])
+
+    def __len__(self):
+        return len(self.strings['raw'])
+
+    def char_histograms(self, name):
+        '''Memory-mapped CharHistograms of the `processed` or `sorted` strings.'''
+        return CharHistograms.from_arrays(*(_load(self.directory, name + suffix)
+                                            for suffix in ('_alphabet', '_counts', '_lengths')))
+
+    def hits(self, keys, start):
+        '''Posting lists (as global positions) of the given trigram keys.'''
+        at = np.searchsorted(self.keys, keys)
+        inside = at < len(self.keys)
+        at = at[inside][self.keys[at[inside]] == keys[inside]]
+        return [self.postings[self.indptr[i]:self.indptr[i + 1]] + start for i in at]
+
+
+class _Items:
+    '''Lazy sequence of the Prepared choices of a ChoiceIndex.'''
+
+    def __init__(self, index):
+        self.index = index
+
+    def __len__(self):
+        return len(self.index)
+
+    def __getitem__(self, position):
+        segment, local = self.index._locate(position)
+        processed = segment.strings['processed'][local]
+        sorted_tokens = segment.strings['sorted'][local]
+        return Prepared(processed, sorted_tokens, frozenset(sorted_tokens.split()))
+
+    def __iter__(self):
+        return (self[p] for p in range(len(self)))
+
+
+class ChoiceIndex(PreparedChoices):
+    '''A PreparedChoices stored on disk and memory-mapped when opened.
+
+    It can be passed to `match_columns` both as the `right` column and as
+    the blocking `index` (keeping the `limit` candidates sharing the most
+    trigrams with each query).
+    '''
+
+    def __init__(self, path, limit=200, cache_size=2 ** 16):
+        self.path = path
+        self.limit = limit
+        with open(os.path.join(path, 'meta.json')) as f:
+            self.meta = json.load(f)
+        self._process_choice = self._setup(getattr(fuzz, self.meta['scorer']),
+                                           utils.full_process, cache_size)
+        self.segments = [_Segment(os.path.join(path, name)) for name in self.meta['segments']]
+        self.starts = np.cumsum([0] + [len(s) for s in self.segments])
+        # Only meta.json is trusted: an append or delete may have died around it
+        deleted = np.load(os.path.join(path, 'deleted.npy'))[:len(self)]
+        self.deleted = np.zeros(len(self), dtype=bool)
+        self.deleted[:len(deleted)] = deleted
+        self.items = _Items(self)
+
+    @classmethod
+    def build(cls, path, choices, scorer=fuzz.WRatio, **kwargs):
+        '''Process `choices` for `scorer` and write a new index at `path`.'''
+        os.makedirs(path)
+        process_choice = prepare_scorer(scorer)[1]
+        _Segment.write(os.path.join(path, 'segment-00000'), list(choices), process_choice)
+        cls._write_deleted(path, np.zeros(len(choices), dtype=bool))
+        cls._write_meta(path, {'scorer': scorer.__name__, 'segments': ['segment-00000']})
+        return cls(path, **kwargs)
+
+    @staticmethod
+    def _write_meta(path, meta):
+        tmp = os.path.join(path, 'meta.json.tmp')
+        with open(tmp, 'w') as f:
+            json.dump(meta, f)
+        os.replace(tmp, os.path.join(path, 'meta.json'))
+
+    @staticmethod
+    def _write_deleted(path, deleted):
+        tmp = os.path.join(path, 'deleted.tmp.npy')
+        np.save(tmp, deleted)
+        os.replace(tmp, os.path.join(path, 'deleted.npy'))
+
+    def __len__(self):
+        return int(self.starts[-1])
+
+    def _locate(self, position):
+        s = int(np.searchsorted(self.starts, position, side='right')) - 1
+        return self.segments[s], position - self.starts[s]
+
+    def _strings(self, name, positions):
+        out = []
+        for p in np.asarray(positions).ravel():
+            segment, local = self._locate(p)
+            out.append(segment.strings[name][local])
+        return np.array(out, dtype=object)
+
+    def values(self, positions):
+        return self._strings('raw', positions)
+
+    def labels(self, positions):
+        return np.asarray(positions)
+
+    def live(self):
+        return np.flatnonzero(~self.deleted) if self.deleted.any() else None
+
+    def candidates(self, query, limit=None):
+        '''Sorted positions of the live choices sharing the most trigrams with query.'''
+        limit = self.limit if limit is None else limit
+        keys = _gram_keys(utils.full_process(query))
+        hits = [h for segment, start in zip(self.segments, self.starts)
+                for h in segment.hits(keys, start)]
+        return top_candidates(hits, len(self), limit,
+                              self.deleted if self.deleted.any() else None)
+
+    def char_histograms(self, sorted_tokens):
+        if sorted_tokens not in self._histograms:
+            name = 'sorted' if sorted_tokens else 'processed'
+            self._histograms[sorted_tokens] = _concatenate(
+                [segment.char_histograms(name) for segment in self.segments])
+        return self._histograms[sorted_tokens]
+
+    def append(self, choices):
+        '''Add choices in a new segment and return their positions.'''
+        name = 'segment-%05d' % len(self.meta['segments'])
+        directory = os.path.join(self.path, name)
+        # Left over by an append that died before listing it in meta.json
+        if os.path.exists(directory):
+            shutil.rmtree(directory)
+        _Segment.write(directory, list(choices), self._process_choice)
+        segment = _Segment(directory)
+        self._write_meta(self.path, dict(self.meta, segments=self.meta['segments'] + [name]))
+
+        self.meta['segments'].append(name)
+        self.segments.append(segment)
+        self.starts = np.append(self.starts, self.starts[-1] + len(segment))
+        self.deleted = np.append(self.deleted, np.zeros(len(segment), dtype=bool))
+        self._write_deleted(self.path, self.deleted)
+        self._histograms = {}
+        return np.arange(self.starts[-2], self.starts[-1])
+
+    def delete(self, positions):
+        '''Tombstone the choices at `positions` so they are never matched again.'''
+        self.deleted[np.asarray(positions, dtype=np.int64)] = True
+        self._write_deleted(self.path, self.deleted)
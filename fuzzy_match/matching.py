@@ -0,0 +1,307 @@
+'''Many-to-many matching of two string columns.
+
+`match_columns` gives the same answer as the notebook loop
+
+    for i in hr.full_name:
+        ratio = process.extract(i, it.username, limit=1)
+
+but every string is processed once, whole blocks of queries are scored into
+a NumPy score matrix and the top-k per row is taken with argpartition instead
+of one heap per query.
+'''
+import multiprocessing
+from functools import partial
+
+import numpy as np
+import pandas as pd
+from fuzzywuzzy import fuzz, utils
+
+from . import profiling
+from .bounds import BOUNDED_SCORERS, CharHistograms, compared_string, extract_bounded
+
+
+# Scorers that run full_process themselves (process.extract skips the
+# default processor for them and calls them with full_process=False)
+_UNICODE_SCORERS = (fuzz.UWRatio, fuzz.UQRatio)
+_ASCII_SCORERS = (fuzz.WRatio, fuzz.QRatio,
+                  fuzz.token_set_ratio, fuzz.token_sort_ratio,
+                  fuzz.partial_token_set_ratio, fuzz.partial_token_sort_ratio)
+
+# Every fuzz scorer returns an int between 0 and 100
+_INT_SCORERS = _UNICODE_SCORERS + _ASCII_SCORERS + (fuzz.ratio, fuzz.partial_ratio)
+
+# Rough number of cells in one block of the score matrix
+BLOCK_CELLS = 2 ** 22
+
+
+def _no_process(s):
+    return s
+
+
+def prepare_scorer(scorer=fuzz.WRatio, processor=utils.full_process):
+    '''Return (process_query, process_choice, score) as process.extract applies them.
+
+    process.extract runs the query through `processor` before it swaps the
+    default processor out for the self-processing scorers, so the query and
+    the choices can be processed differently (e.g. a non-breaking space
+    splits a query into two tokens but glues a choice together).
+    '''
+    if processor is None:
+        processor = _no_process
+    query_processor = processor
+    if scorer in _UNICODE_SCORERS + _ASCII_SCORERS and processor is utils.full_process:
+        processor = _no_process
+
+    if scorer in _UNICODE_SCORERS:
+        pre_processor = partial(utils.full_process, force_ascii=False)
+        scorer = partial(scorer, full_process=False)
+    elif scorer in _ASCII_SCORERS:
+        pre_processor = partial(utils.full_process, force_ascii=True)
+        scorer = partial(scorer, full_process=False)
+    else:
+        pre_processor = _no_process
+
+    def process_query(s):
+        return pre_processor(query_processor(s))
+
+    def process_choice(s):
+        return pre_processor(processor(s))
+
+    return process_query, process_choice, scorer
+
+
+def _as_series(values):
+    if isinstance(values, pd.Series):
+        return values
+    return pd.Series(list(values))
+
+
+def score_block(queries, choices, score, dtype=np.float32, candidates=None):
+    '''Score every processed query against every processed choice.
+
+    With `candidates` (one array of choice positions per query) only those
+    pairs are scored; the other cells are left at -1.
+    '''
+    if candidates is None:
+        matrix = np.empty((len(queries), len(choices)), dtype=dtype)
+        for r, q in enumerate(queries):
+            matrix[r] = [score(q, c) for c in choices]
+        profiling.count('comparisons', matrix.size)
+        return matrix
+
+    matrix = np.full((len(queries), len(choices)), -1, dtype=dtype)
+    for r, (q, positions) in enumerate(zip(queries, candidates)):
+        matrix[r, positions] = [score(q, choices[p]) for p in positions]
+    if profiling.active() is not None:
+        scored = sum(len(p) for p in candidates)
+        profiling.count('comparisons', scored)
+        profiling.count('comparisons_skipped', matrix.size - scored)
+    return matrix
+
+
+def select_top_k(matrix, k):
+    '''Column indices and scores of the k best entries of every row.
+
+    Ties go to the lowest column, like heapq.nlargest in process.extract.
+    '''
+    k = min(k, matrix.shape[1])
+    kth = -np.partition(-matrix, k - 1, axis=1)[:, k - 1]
+    cols = np.empty((matrix.shape[0], k), dtype=np.intp)
+    for r, row in enumerate(matrix):
+        candidates = np.flatnonzero(row >= kth[r])
+        order = np.lexsort((candidates, -row[candidates]))[:k]
+        cols[r] = candidates[order]
+    return cols, np.take_along_axis(matrix, cols, axis=1)
+
+
+def _match_bounded(queries, job):
+    k, sorted_tokens, partial_ratio = job['k'], job['sorted_tokens'], job['partial']
+    cols = np.zeros((len(queries), k), dtype=np.intp)
+    scores = np.full((len(queries), k), -1, dtype=job['dtype'])
+    everything = np.arange(len(job['choices'])) if job['live'] is None else job['live']
+    for r, (q, raw) in enumerate(queries):
+        if job['index'] is None:
+            positions = everything
+        else:
+            with profiling.stage('candidates'):
+                positions = job['index'].candidates(raw)
+            profiling.count('comparisons_skipped', len(everything) - len(positions))
+        best = extract_bounded(q, job['choices'], job['histograms'], job['score'], k,
+                               positions, partial_ratio, job['score_cutoff'],
+                               compared_string(q, sorted_tokens))
+        for rank, (score, position) in enumerate(best):
+            cols[r, rank], scores[r, rank] = position, score
+    return cols, scores
+
+
+def _match_blocks(queries, job):
+    '''Top-k columns and scores of a list of (processed, raw) queries.'''
+    if job['histograms'] is not None:
+        return _match_bounded(queries, job)
+
+    cols, scores = [], []
+    block_size = job['block_size']
+    for start in range(0, len(queries), block_size):
+        block = queries[start:start + block_size]
+        candidates = None
+        if job['index'] is not None:
+            with profiling.stage('candidates'):
+                candidates = [job['index'].candidates(raw) for _, raw in block]
+        elif job['live'] is not None:
+            candidates = [job['live']] * len(block)
+        with profiling.stage('score'):
+            matrix = score_block([q for q, _ in block], job['choices'], job['score'],
+                                 job['dtype'], candidates)
+        with profiling.stage('select'):
+            block_cols, block_scores = select_top_k(matrix, job['k'])
+        cols.append(block_cols)
+        scores.append(block_scores)
+    return np.vstack(cols), np.vstack(scores)
+
+
+# Read-only state of a worker process, set once by _init_worker. Under the
+# fork start method it is inherited copy-on-write instead of being pickled.
+_worker = {}
+
+
+def _init_worker(job):
+    _worker.update(job)
+
+
+def _match_chunk(queries):
+    if not _worker['profile']:
+        return _match_blocks(queries, _worker), None
+    # Recorded in the worker and merged into the parent's profile
+    with profiling.enabled(profiling.Profile(*_worker['profile'])) as profile:
+        return _match_blocks(queries, _worker), profile
+
+
+def _pool_context():
+    if 'fork' in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context('fork')
+    return multiprocessing.get_context()
+
+
+def match_columns(left, right, scorer=fuzz.WRatio, top_k=1,
+                  processor=utils.full_process, block_size=None, index=None,
+                  workers=1, score_cutoff=0, early_exit=True):
+    '''Match every string in `left` against the strings in `right`.
+
+    Returns one row per (left row, rank) indexed like `left`, with the
+    matched value of `right` (`match`), its `similarity`, its index label in
+    `right` (`choice_index`) and its `rank` (0 is the best match).
+
+    `right` may also be a `fuzzy_match.prepared.PreparedChoices`, whose
+    choices were processed and tokenized once for its own scorer (`scorer`
+    and `processor` are then ignored).
+
+    `index` is an optional blocking index built over `right` (see
+    `fuzzy_match.blocking.NGramIndex`); when given, each query is only scored
+    against the candidates it returns. Rows without any candidate are dropped.
+
+    With `workers` > 1 the queries are split into chunks matched by a pool
+    of processes. The processed choices and the index are handed to each
+    worker once (shared copy-on-write where fork is available) and the
+    result is identical to the serial one.
+
+    Only matches scoring at least `score_cutoff` are kept. For the ratio
+    scorers (`ratio`, `partial_ratio`, `QRatio`, `UQRatio`, `token_sort_ratio`
+    and `partial_token_sort_ratio`) candidates are visited best upper bound
+    first and skipped once they can't make the top k or reach the cutoff
+    (see `fuzzy_match.bounds`); `early_exit=False` scores every pair instead.
+    Both give the same result.
+    '''
+    from .prepared import PreparedChoices
+
+    left = _as_series(left)
+    if not isinstance(right, PreparedChoices):
+        right = _as_series(right)
+    columns = ['match', 'similarity', 'choice_index', 'rank']
+    if len(left) == 0 or len(right) == 0:
+        return pd.DataFrame(columns=columns)
+
+    raw_queries = list(left)
+    live = None
+    with profiling.stage('process'):
+        if isinstance(right, PreparedChoices):
+            scorer, score, dtype = right.scorer, right.score, right.dtype
+            queries = [right.prepare_query(q) for q in raw_queries]
+            choices = right.items
+            live = right.live()
+        else:
+            process_query, process_choice, score = prepare_scorer(scorer, processor)
+            dtype = np.int16 if scorer in _INT_SCORERS else np.float32
+            queries = [process_query(q) for q in raw_queries]
+            choices = [process_choice(c) for c in right]
+    if block_size is None:
+        block_size = max(1, BLOCK_CELLS // len(choices))
+
+    profile = profiling.active()
+    job = {'choices': choices, 'score': score, 'dtype': dtype, 'k': min(top_k, len(choices)),
+           'block_size': block_size, 'index': index, 'live': live,
+           'score_cutoff': score_cutoff, 'histograms': None,
+           # Worker profiles record like the parent's: Profile(trace, max_events)
+           'profile': profile and (profile.trace, profile.max_events)}
+    if early_exit and scorer in BOUNDED_SCORERS:
+        job['sorted_tokens'], job['partial'] = BOUNDED_SCORERS[scorer]
+        with profiling.stage('process'):
+            if isinstance(right, PreparedChoices):
+                job['histograms'] = right.char_histograms(job['sorted_tokens'])
+            else:
+                job['histograms'] = CharHistograms(
+                    [compared_string(c, job['sorted_tokens']) for c in choices])
+
+    queries = list(zip(queries, raw_queries))
+    if workers > 1 and len(queries) > 1:
+        # A few chunks per worker keeps the pool busy when chunks are uneven
+        size = max(1, -(-len(queries) // (workers * 4)))
+        chunks = [queries[i:i + size] for i in range(0, len(queries), size)]
+        with _pool_context().Pool(workers, _init_worker, (job,)) as pool:
+            parts = pool.map(_match_chunk, chunks)
+        for _, profile in parts:
+            if profile is not None:
+                profiling.active().merge(profile)
+        cols = np.vstack([c for (c, _), _ in parts])
+        scores = np.vstack([s for (_, s), _ in parts])
+    else:
+        cols, scores = _match_blocks(queries, job)
+
+    with profiling.stage('assemble'):
+        k = cols.shape[1]
+        flat = cols.ravel()
+        if isinstance(right, PreparedChoices):
+            values, labels = right.values(flat), right.labels(flat)
+        else:
+            values, labels = right.to_numpy()[flat], right.index.to_numpy()[flat]
+        result = pd.DataFrame({
+            'match': values,
+            'similarity': scores.ravel(),
+            'choice_index': labels,
+            'rank': np.tile(np.arange(k), len(left)),
+        }, index=left.index.repeat(k))
+        if score_cutoff:
+            result = result[result['similarity'] >= score_cutoff]
+        if index is not None or live is not None or job['histograms'] is not None:
+            result = result[result['similarity'] >= 0]
+    return result
+
+
+def match_with_confidence(left, right, ambiguity_margin=10, **kwargs):
+    '''Best match of every row with its runner-up and the margin between them.
+
+    Both come out of the same top-2 pass of `match_columns(**kwargs)`. Rows
+    whose best score beats the runner-up by less than `ambiguity_margin`
+    points are flagged `ambiguous`: those are the ones worth sending to a
+    slower scorer or a human. Without a runner-up the margin is the best
+    score itself.
+    '''
+    kwargs['top_k'] = 2
+    matches = match_columns(left, right, **kwargs)
+    best = matches[matches['rank'] == 0].drop(columns='rank')
+    second = matches[matches['rank'] == 1]
+
+    best['runner_up'] = second['match'].reindex(best.index)
+    best['runner_up_similarity'] = second['similarity'].reindex(best.index)
+    best['margin'] = best['similarity'] - best['runner_up_similarity'].fillna(0)
+    best['ambiguous'] = best['margin'] < ambiguity_margin
+    return best
@@ -0,0 +1,240 @@
+'''Similarity of long documents with MinHash signatures and banded LSH.
+
+`ratio`, `partial_ratio` and the token ratios of `fuzzy_match_learn.py` run
+difflib on the whole texts, which is quadratic in their length. Here a
+document is reduced to the set of its word shingles (single tokens by
+default, as `token_set_ratio` sees it) and that set to `num_perm` MinHash
+values. The share of equal values estimates the Jaccard similarity of the
+two sets in time linear in the text length, with a standard error of about
+`sqrt(J * (1 - J) / num_perm)`. Together with the set sizes it also gives
+the number of shared tokens, hence a `token_set_ratio`-style score that,
+like it, is 100 when one text's tokens are a subset of the other's.
+
+To find near-duplicates in a corpus without comparing all pairs, the
+signatures are cut into bands: documents sharing a whole band land in the
+same bucket and only those candidate pairs are compared. The number of
+bands is picked so that pairs at `threshold` become candidates with
+probability above one half; the candidates are then checked against the
+threshold, so extra ones only cost time.
+'''
+import time
+import zlib
+
+import numpy as np
+import pandas as pd
+from fuzzywuzzy import fuzz, utils
+
+from . import profiling
+from .matching import _as_series
+
+
+# Smallest prime above 2**32: (a * x + b) % _PRIME fits in uint64 for 32-bit x
+_PRIME = np.uint64(4294967311)
+
+# The exact scorers MinHash is compared with by accuracy_report
+EXACT_SCORERS = {'TSeR': fuzz.token_set_ratio, 'TSoR': fuzz.token_sort_ratio}
+
+
+class MinHasher:
+    '''MinHash signatures of the `shingle_size`-word shingles of texts.'''
+
+    def __init__(self, num_perm=128, shingle_size=1, processor=utils.full_process, seed=1):
+        self.num_perm = num_perm
+        self.shingle_size = shingle_size
+        self.processor = processor
+        rng = np.random.default_rng(seed)
+        self.a = rng.integers(1, 2 ** 32, size=num_perm, dtype=np.uint64)[:, None]
+        self.b = rng.integers(0, 2 ** 32, size=num_perm, dtype=np.uint64)[:, None]
+
+    def shingles(self, text):
+        '''32-bit hashes of the distinct shingles of a text.'''
+        tokens = self.processor(text).split()
+        k = min(self.shingle_size, len(tokens))
+        grams = {' '.join(tokens[i:i + k]) for i in range(len(tokens) - k + 1)} if k else ()
+        return np.fromiter((zlib.crc32(g.encode('utf-8')) for g in grams),
+                           dtype=np.uint64, count=len(grams))
+
+    def signatures(self, texts):
+        '''(signatures, sizes): one signature per row and the size of its shingle set.'''
+        with profiling.stage('signatures'):
+            shingles = [self.shingles(t) for t in texts]
+            signatures = np.full((len(shingles), self.num_perm), _PRIME, dtype=np.uint64)
+            for row, hashes in enumerate(shingles):
+                if len(hashes):
+                    signatures[row] = ((self.a * hashes + self.b) % _PRIME).min(axis=1)
+        return signatures, np.array([len(h) for h in shingles], dtype=np.int64)
+
+
+def estimate(sig1, sig2):
+    '''Estimated Jaccard similarity of the signatures in the last axis.'''
+    return ((sig1 == sig2) & (sig1 != _PRIME)).mean(axis=-1)
+
+
+def token_set_score(jaccard, size1, size2):
+    '''`token_set_ratio`-style 0-100 score from a Jaccard similarity and the set sizes.
+
+    With I shared tokens it is 2I / (I + the smaller size): the ratio of the
+    intersection against the intersection plus the smaller remainder.
+    '''
+    jaccard = np.asarray(jaccard, dtype=np.float64)
+    shared = jaccard * (size1 + size2) / (1 + jaccard)
+    smaller = np.minimum(size1, size2)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        score = np.where(smaller > 0, 200 * shared / (shared + smaller), 0)
+    # The estimated intersection can exceed the smaller set
+    return np.minimum(score, 100)
+
+
+def similarity(text1, text2, hasher=None, kind='token_set'):
+    '''Estimated similarity of two texts on the fuzz 0-100 scale.
+
+    `kind` is 'token_set' (see `token_set_score`) or 'jaccard'.
+    '''
+    hasher = hasher or MinHasher()
+    signatures, sizes = hasher.signatures([text1, text2])
+    jaccard = estimate(signatures[0], signatures[1])
+    if kind == 'jaccard':
+        return utils.intr(100 * jaccard)
+    if kind == 'token_set':
+        return utils.intr(float(token_set_score(jaccard, sizes[0], sizes[1])))
+    raise ValueError('kind must be token_set or jaccard, not %r' % kind)
+
+
+def _bands(num_perm, threshold):
+    '''Fewest bands whose LSH S-curve crosses one half at or below threshold.'''
+    options = [b for b in range(1, num_perm + 1) if num_perm % b == 0]
+    return next((b for b in options if (1 / b) ** (b / num_perm) <= threshold), num_perm)
+
+
+class LSHIndex:
+    '''Banded LSH over a matrix of MinHash signatures (one row per document).'''
+
+    def __init__(self, signatures, threshold=0.8, bands=None):
+        self.signatures = signatures
+        num_perm = signatures.shape[1]
+        self.bands = bands or _bands(num_perm, threshold)
+        self.rows = num_perm // self.bands
+        mult = np.random.default_rng(0).integers(1, 2 ** 63, size=num_perm, dtype=np.uint64)
+        self._mult = mult.reshape(self.bands, self.rows) | np.uint64(1)
+        with profiling.stage('lsh'):
+            self.keys = self._keys(signatures)
+            self.order = np.argsort(self.keys, axis=0, kind='stable')
+            self.sorted_keys = np.take_along_axis(self.keys, self.order, axis=0)
+
+    def _keys(self, signatures):
+        # One uint64 hash per band (wrapping multiply-add of its values)
+        bands = signatures[..., :self.bands * self.rows].reshape(
+            signatures.shape[:-1] + (self.bands, self.rows))
+        return (bands * self._mult).sum(axis=-1)
+
+    def candidates(self, signature):
+        '''Sorted positions of the documents sharing a band with a signature.'''
+        keys = self._keys(signature)
+        found = []
+        for band, key in enumerate(keys):
+            column = self.sorted_keys[:, band]
+            lo, hi = np.searchsorted(column, key), np.searchsorted(column, key, 'right')
+            found.append(self.order[lo:hi, band])
+        return np.unique(np.concatenate(found))
+
+    def candidate_pairs(self):
+        '''(first, second) position arrays of every pair sharing a band, first < second.'''
+        n = len(self.signatures)
+        pairs = []
+        for band in range(self.bands):
+            column, order = self.sorted_keys[:, band], self.order[:, band]
+            starts = np.flatnonzero(np.r_[True, column[1:] != column[:-1]])
+            sizes = np.diff(np.r_[starts, len(column)])
+            for start, size in zip(starts[sizes > 1], sizes[sizes > 1]):
+                members = np.sort(order[start:start + size])
+                i, j = np.triu_indices(size, 1)
+                pairs.append(members[i] * n + members[j])
+        if not pairs:
+            return np.empty(0, dtype=np.intp), np.empty(0, dtype=np.intp)
+        pairs = np.unique(np.concatenate(pairs))
+        return np.divmod(pairs, n)
+
+
+def near_duplicates(texts, threshold=0.8, hasher=None, bands=None):
+    '''Pairs of texts whose estimated Jaccard similarity is at least `threshold`.
+
+    Returns the index labels of both texts (`first` before `second`), their
+    `jaccard` and token set `similarity` on the 0-100 scale, most similar
+    first. Only pairs sharing an LSH band are compared, so a pair at the
+    threshold may be missed (the `recall` of `accuracy_report`), one well
+    above it almost never.
+    '''
+    texts = _as_series(texts)
+    hasher = hasher or MinHasher()
+    signatures, sizes = hasher.signatures(texts)
+    first, second = LSHIndex(signatures, threshold, bands).candidate_pairs()
+    with profiling.stage('score'):
+        jaccard = np.concatenate([
+            estimate(signatures[first[i:i + 4096]], signatures[second[i:i + 4096]])
+            for i in range(0, len(first), 4096)] or [np.empty(0)])
+    profiling.count('comparisons', len(first))
+    profiling.count('comparisons_skipped', len(texts) * (len(texts) - 1) // 2 - len(first))
+
+    keep = jaccard >= threshold
+    first, second, jaccard = first[keep], second[keep], jaccard[keep]
+    labels = texts.index.to_numpy()
+    result = pd.DataFrame({
+        'first': labels[first], 'second': labels[second],
+        'jaccard': np.rint(100 * jaccard).astype(np.int16),
+        'similarity': np.rint(token_set_score(jaccard, sizes[first], sizes[second])
+                              ).astype(np.int16),
+    })
+    return result.sort_values('jaccard', ascending=False, kind='stable').reset_index(drop=True)
+
+
+def accuracy_report(texts, threshold=0.8, hasher=None, scorers=EXACT_SCORERS):
+    '''Compare MinHash with the exact scores on every pair of a small corpus.
+
+    The exact Jaccard similarity of the shingle sets is compared with its
+    MinHash estimate and each exact scorer with the token set estimate.
+    Each row reports the mean absolute error and correlation of the
+    estimate, the `seconds` the exact scores took (the `minhash` row: all
+    the signatures and estimates) and the precision and recall of
+    `near_duplicates` against the pairs the exact score puts at `threshold`
+    or above.
+    '''
+    texts = list(texts)
+    hasher = hasher or MinHasher()
+    first, second = np.triu_indices(len(texts), 1)
+
+    start = time.perf_counter()
+    signatures, sizes = hasher.signatures(texts)
+    jaccard = estimate(signatures[first], signatures[second])
+    estimates = {'jaccard': 100 * jaccard,
+                 'token_set': token_set_score(jaccard, sizes[first], sizes[second])}
+    report = {'minhash': {'seconds': time.perf_counter() - start}}
+    found = near_duplicates(texts, threshold, hasher)
+    found = set(zip(found['first'], found['second']))
+
+    references = {}
+    start = time.perf_counter()
+    shingles = [set(hasher.shingles(t).tolist()) for t in texts]
+    references['jaccard'] = np.array([
+        100 * len(shingles[i] & shingles[j]) / len(shingles[i] | shingles[j])
+        if shingles[i] or shingles[j] else 0 for i, j in zip(first, second)])
+    seconds = {'jaccard': time.perf_counter() - start}
+    for name, scorer in scorers.items():
+        start = time.perf_counter()
+        references[name] = np.array([scorer(texts[i], texts[j]) for i, j in zip(first, second)])
+        seconds[name] = time.perf_counter() - start
+
+    for name, exact in references.items():
+        estimated = estimates['jaccard' if name == 'jaccard' else 'token_set']
+        duplicates = set(zip(first[exact >= 100 * threshold], second[exact >= 100 * threshold]))
+        hits = len(found & duplicates)
+        report[name] = {
+            'seconds': seconds[name],
+            'mean_abs_error': float(np.abs(estimated - exact).mean()),
+            'correlation': float(np.corrcoef(estimated, exact)[0, 1]) if len(exact) > 1 else None,
+            'duplicates': len(duplicates),
+            'precision': hits / len(found) if found else None,
+            'recall': hits / len(duplicates) if duplicates else None,
+        }
+    report = pd.DataFrame(report).T
+    report.index.name = 'reference'
+    return report
@@ -0,0 +1,145 @@
+'''Matching pipelines combining a cheap exact pass with fuzzy matching.'''
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+from fuzzywuzzy import fuzz
+
+from .matching import _as_series, match_columns, prepare_scorer
+
+
+# One step of cascade_match: a row is settled by a stage when its best score
+# is at least `min_score` and beats the runner-up by at least `min_margin`
+Stage = namedtuple('Stage', ['scorer', 'min_score', 'min_margin'], defaults=(0, 0))
+
+
+def _exact_positions(left_keys, right_keys):
+    right_keys = _as_series(right_keys)
+    first = ~right_keys.duplicated().to_numpy()
+    lookup = pd.Series(np.flatnonzero(first), index=right_keys.to_numpy()[first])
+    return _as_series(left_keys).map(lookup)
+
+
+def exact_match(left_keys, right_keys):
+    '''Index label of the first row of `right_keys` equal to each left key.
+
+    This is a hashed join, so it costs O(N + M) instead of the O(N x M) of
+    `hr.apply(lambda x: x.gen_email in list(it.email), axis=1)`. Rows without
+    an exact match are NaN.
+    '''
+    positions = _exact_positions(left_keys, right_keys)
+    labels = _as_series(right_keys).index
+    return positions.map(lambda p: labels[int(p)], na_action='ignore')
+
+
+def two_stage_match(left, right, left_keys, right_keys, **kwargs):
+    '''Resolve exact key matches first and fuzzy match only the other rows.
+
+    `left_keys`/`right_keys` are aligned with `left`/`right` (e.g.
+    `hr.gen_email` and `it.email` for `hr.full_name` and `it.username`). Rows
+    resolved by the exact pass get a single result with similarity 100;
+    the remaining rows go through `match_columns(**kwargs)`. The `method`
+    column says which stage produced each row.
+    '''
+    left, right = _as_series(left), _as_series(right)
+    hits = _exact_positions(left_keys, right_keys).to_numpy()
+    found = ~pd.isna(hits)
+    hits = hits[found].astype(np.intp)
+
+    exact = pd.DataFrame({
+        'match': right.to_numpy()[hits],
+        'similarity': 100,
+        'choice_index': right.index.to_numpy()[hits],
+        'rank': 0,
+        'method': 'exact',
+        '_position': np.flatnonzero(found),
+    })
+    rest = np.flatnonzero(~found)
+    result = exact
+    if len(rest):
+        fuzzy = match_columns(left.iloc[rest].reset_index(drop=True), right, **kwargs)
+        fuzzy['method'] = 'fuzzy'
+        fuzzy['_position'] = rest[fuzzy.index.to_numpy(dtype=np.intp)]
+        result = pd.concat([exact, fuzzy.reset_index(drop=True)], ignore_index=True)
+
+    result = result.sort_values('_position', kind='stable')
+    result.index = left.index[result.pop('_position').to_numpy()]
+    return result
+
+
+def _rerank(queries, choices, candidates, scorer):
+    '''Score each query against its own candidate positions with `scorer`.'''
+    process_query, process_choice, score = prepare_scorer(scorer)
+    processed = {}
+    ranked = []
+    for query, positions in zip(queries, candidates):
+        q = process_query(query)
+        scores = []
+        for p in positions:
+            if p not in processed:
+                processed[p] = process_choice(choices[p])
+            scores.append(score(q, processed[p]))
+        scores = np.array(scores)
+        order = np.lexsort((positions, -scores))
+        ranked.append((positions[order], scores[order]))
+    return ranked
+
+
+def cascade_match(left, right, stages=(Stage(fuzz.ratio, 90, 10), Stage(fuzz.partial_ratio)),
+                  top_k=10, **kwargs):
+    '''Match with a cheap scorer and re-rank uncertain rows with dearer ones.
+
+    The first stage runs `match_columns(scorer=stages[0].scorer,
+    top_k=top_k, **kwargs)` over every pair and keeps the `top_k` candidates
+    of each row. Each later stage only re-scores the candidates of the rows
+    the previous stages did not settle (see `Stage`); the last stage decides
+    whatever is left. The `stage` column tells which stage picked each match
+    and `accepted` whether it met that stage's thresholds.
+    '''
+    left, right = _as_series(left), _as_series(right)
+    choices = right.reset_index(drop=True)
+    first = match_columns(left.reset_index(drop=True), choices,
+                          scorer=stages[0].scorer, top_k=top_k, **kwargs)
+
+    queries = list(left)
+    candidates = [np.empty(0, dtype=np.intp)] * len(left)
+    best = [(np.empty(0, dtype=np.intp), np.empty(0))] * len(left)
+    for row, group in first.groupby(level=0, sort=False):
+        positions = group['choice_index'].to_numpy(dtype=np.intp)
+        candidates[row] = positions
+        best[row] = (positions, group['similarity'].to_numpy())
+
+    match = np.full(len(left), -1, dtype=np.intp)
+    similarity = np.full(len(left), np.nan)
+    margin = np.full(len(left), np.nan)
+    decided_by = np.full(len(left), -1)
+    accepted = np.zeros(len(left), dtype=bool)
+
+    pending = np.flatnonzero([len(c) > 0 for c in candidates])
+    for number, stage in enumerate(stages):
+        if number > 0:
+            best = dict(zip(pending, _rerank([queries[r] for r in pending], choices,
+                                             [candidates[r] for r in pending],
+                                             stage.scorer)))
+        last = number == len(stages) - 1
+        still_pending = []
+        for row in pending:
+            positions, scores = best[row]
+            gap = scores[0] - scores[1] if len(scores) > 1 else scores[0]
+            ok = scores[0] >= stage.min_score and gap >= stage.min_margin
+            if ok or last:
+                match[row], similarity[row], margin[row] = positions[0], scores[0], gap
+                decided_by[row], accepted[row] = number, ok
+            else:
+                still_pending.append(row)
+        pending = np.array(still_pending, dtype=np.intp)
+
+    found = match >= 0
+    return pd.DataFrame({
+        'match': right.to_numpy()[match[found]],
+        'similarity': similarity[found],
+        'choice_index': right.index.to_numpy()[match[found]],
+        'margin': margin[found],
+        'stage': decided_by[found],
+        'accepted': accepted[found],
+    }, index=left.index[found])
@@ -0,0 +1,205 @@
+'''Choices processed and tokenized once instead of once per comparison.
+
+The token scorers (`token_sort_ratio`, `token_set_ratio`, `partial_token_*`,
+`WRatio`) run `full_process` and split both strings into tokens on every
+call, so in the 200x200 hr/it run each username is lowercased, stripped and
+split 200 times. A `Prepared` string keeps the processed string, its sorted
+token string and its token set; the scorers below compute exactly the same
+scores as their `fuzz` counterparts from two `Prepared` strings.
+'''
+from collections import OrderedDict, namedtuple
+
+import numpy as np
+from fuzzywuzzy import fuzz, utils
+
+from . import profiling
+from .bounds import CharHistograms, compared_string
+from .matching import _INT_SCORERS, _as_series, prepare_scorer
+
+
+Prepared = namedtuple('Prepared', ['processed', 'sorted_tokens', 'tokens'])
+
+
+def prepare(processed):
+    '''Build the Prepared form of an already processed string.'''
+    tokens = processed.split()
+    return Prepared(processed, ' '.join(sorted(tokens)).strip(), frozenset(tokens))
+
+
+def _token_set(p1, p2, ratio_func):
+    # Same as fuzz._token_set with full_process=False
+    if p1.processed == p2.processed:
+        return 100
+    if not p1.processed or not p2.processed:
+        return 0
+
+    sorted_sect = ' '.join(sorted(p1.tokens & p2.tokens))
+    combined_1to2 = (sorted_sect + ' ' + ' '.join(sorted(p1.tokens - p2.tokens))).strip()
+    combined_2to1 = (sorted_sect + ' ' + ' '.join(sorted(p2.tokens - p1.tokens))).strip()
+    sorted_sect = sorted_sect.strip()
+
+    return max(ratio_func(sorted_sect, combined_1to2),
+               ratio_func(sorted_sect, combined_2to1),
+               ratio_func(combined_1to2, combined_2to1))
+
+
+def ratio(p1, p2):
+    return fuzz.ratio(p1.processed, p2.processed)
+
+
+def partial_ratio(p1, p2):
+    return fuzz.partial_ratio(p1.processed, p2.processed)
+
+
+def token_sort_ratio(p1, p2):
+    return fuzz.ratio(p1.sorted_tokens, p2.sorted_tokens)
+
+
+def partial_token_sort_ratio(p1, p2):
+    return fuzz.partial_ratio(p1.sorted_tokens, p2.sorted_tokens)
+
+
+def token_set_ratio(p1, p2):
+    return _token_set(p1, p2, fuzz.ratio)
+
+
+def partial_token_set_ratio(p1, p2):
+    return _token_set(p1, p2, fuzz.partial_ratio)
+
+
+def QRatio(p1, p2):
+    if not p1.processed or not p2.processed:
+        return 0
+    return fuzz.ratio(p1.processed, p2.processed)
+
+
+def WRatio(p1, p2):
+    # Same steps as fuzz.WRatio with full_process=False
+    s1, s2 = p1.processed, p2.processed
+    if not s1 or not s2:
+        return 0
+
+    unbase_scale = .95
+    partial_scale = .90
+    base = fuzz.ratio(s1, s2)
+    len_ratio = float(max(len(s1), len(s2))) / min(len(s1), len(s2))
+    if len_ratio > 8:
+        partial_scale = .6
+
+    if len_ratio >= 1.5:
+        partial = fuzz.partial_ratio(s1, s2) * partial_scale
+        ptsor = partial_token_sort_ratio(p1, p2) * unbase_scale * partial_scale
+        ptser = partial_token_set_ratio(p1, p2) * unbase_scale * partial_scale
+        return utils.intr(max(base, partial, ptsor, ptser))
+
+    tsor = token_sort_ratio(p1, p2) * unbase_scale
+    tser = token_set_ratio(p1, p2) * unbase_scale
+    return utils.intr(max(base, tsor, tser))
+
+
+# The fuzz scorers with a Prepared counterpart. The unicode variants differ
+# only in how the strings are processed, which is done before preparing.
+PREPARED_SCORERS = {
+    fuzz.ratio: ratio, fuzz.partial_ratio: partial_ratio,
+    fuzz.token_sort_ratio: token_sort_ratio,
+    fuzz.partial_token_sort_ratio: partial_token_sort_ratio,
+    fuzz.token_set_ratio: token_set_ratio,
+    fuzz.partial_token_set_ratio: partial_token_set_ratio,
+    fuzz.QRatio: QRatio, fuzz.UQRatio: QRatio,
+    fuzz.WRatio: WRatio, fuzz.UWRatio: WRatio,
+}
+
+
+class _Fallback:
+    '''Call a scorer without a Prepared counterpart on the processed strings.'''
+
+    def __init__(self, score):
+        self.score = score
+
+    def __call__(self, p1, p2):
+        return self.score(p1.processed, p2.processed)
+
+
+def prepared_scorer(scorer):
+    '''Scorer taking two Prepared strings, equivalent to `scorer` in process.extract.'''
+    if scorer in PREPARED_SCORERS:
+        return PREPARED_SCORERS[scorer]
+    return _Fallback(prepare_scorer(scorer)[2])
+
+
+class PreparedChoices:
+    '''A choice column prepared once for a given scorer.
+
+    Pass it as the `right` argument of `match_columns` (the scorer it was
+    prepared for is used). Query strings are prepared through an LRU cache
+    of `cache_size` entries, so repeated queries are processed only once.
+    '''
+
+    def __init__(self, choices, scorer=fuzz.WRatio, processor=utils.full_process,
+                 cache_size=2 ** 16):
+        self.choices = _as_series(choices)
+        process_choice = self._setup(scorer, processor, cache_size)
+        self.items = [prepare(process_choice(c)) for c in self.choices]
+
+    def _setup(self, scorer, processor, cache_size):
+        self.scorer = scorer
+        self.processor = processor
+        self.score = prepared_scorer(scorer)
+        self.dtype = np.int16 if scorer in _INT_SCORERS else np.float32
+        self._process_query, process_choice, _ = prepare_scorer(scorer, processor)
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self.hits = self.misses = 0
+        self._histograms = {}
+        return process_choice
+
+    def __len__(self):
+        return len(self.items)
+
+    def values(self, positions):
+        '''Original choice values at `positions`.'''
+        return self.choices.to_numpy()[positions]
+
+    def labels(self, positions):
+        '''Index labels of the choices at `positions`.'''
+        return self.choices.index.to_numpy()[positions]
+
+    def live(self):
+        '''Positions that may be matched, or None for all of them.'''
+        return None
+
+    def char_histograms(self, sorted_tokens):
+        '''CharHistograms of the strings the ratio bounds are computed on.'''
+        if sorted_tokens not in self._histograms:
+            self._histograms[sorted_tokens] = CharHistograms(
+                [compared_string(c, sorted_tokens) for c in self.items])
+        return self._histograms[sorted_tokens]
+
+    def __getstate__(self):
+        # The query processor is a closure; workers only need the items
+        state = self.__dict__.copy()
+        state['_process_query'] = None
+        state['_cache'] = OrderedDict()
+        return state
+
+    def prepare_query(self, query):
+        '''Prepared form of a query, served from the LRU cache when possible.'''
+        try:
+            prepared = self._cache[query]
+        except KeyError:
+            self.misses += 1
+            profiling.count('query_cache.misses')
+            prepared = prepare(self._process_query(query))
+            self._cache[query] = prepared
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+            return prepared
+        self.hits += 1
+        profiling.count('query_cache.hits')
+        self._cache.move_to_end(query)
+        return prepared
+
+    def scores(self, query):
+        '''Scores of one query against every choice.'''
+        q = self.prepare_query(query)
+        return np.array([self.score(q, c) for c in self.items], dtype=self.dtype)
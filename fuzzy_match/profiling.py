@@ -0,0 +1,168 @@
+'''Opt-in instrumentation of the matching hot paths.
+
+Matching code wraps its stages in `stage(name)` and reports what it did
+through `count(name, n)`. Both do nothing but check one global while no
+`Profile` is active, so they stay in place at no measurable cost:
+
+    with profiling.enabled(trace=True) as profile:
+        match_columns(hr.full_name, it.username)
+    print(profile.summary())
+    profile.write_chrome_trace('match.trace.json')   # chrome://tracing, Perfetto
+
+The stages recorded are `read_csv` (streaming), `process` (string
+preprocessing), `candidates` (blocking lookups), `bounds`, `score` (scorer
+calls), `select` (top-k) and `assemble` (result DataFrame). The counters
+are `comparisons` and `comparisons_skipped` (pairs scored or pruned by
+blocking and early exit) and the `*_cache.hits` / `*_cache.misses` of the
+query cache of `PreparedChoices` and of `ScoreCache`.
+
+Stage times and counters are totals, so they take the same memory however
+long the run. Trace events, one per stage call, are only kept with
+`trace=True`, and only the first `max_events` of them (a million by
+default); the rest are counted in `dropped_events`.
+
+`enabled(cprofile=path)` also runs cProfile and dumps its stats to `path`.
+Worker processes of `match_columns(workers=...)` record into their own
+profile, which is merged into the active one.
+'''
+import cProfile
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+
+import pandas as pd
+
+
+_active = None
+_disabled = nullcontext()
+
+
+class _Stage:
+    __slots__ = ('profile', 'name', 'start')
+
+    def __init__(self, profile, name):
+        self.profile = profile
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+
+    def __exit__(self, *exc_info):
+        self.profile.add(self.name, self.start, time.perf_counter_ns() - self.start)
+
+
+class Profile:
+    '''Time per stage, counters and (with `trace`) the trace events of one run.'''
+
+    def __init__(self, trace=False, max_events=10 ** 6):
+        self.trace = trace
+        self.max_events = max_events
+        self.seconds = {}
+        self.calls = {}
+        self.counters = {}
+        self.events = []  # (name, start ns, duration ns, pid, tid)
+        self.dropped_events = 0
+
+    def add(self, name, start, duration):
+        self.seconds[name] = self.seconds.get(name, 0) + duration / 1e9
+        self.calls[name] = self.calls.get(name, 0) + 1
+        if not self.trace:
+            return
+        if len(self.events) < self.max_events:
+            self.events.append((name, start, duration, os.getpid(), threading.get_ident()))
+        else:
+            self.dropped_events += 1
+
+    def count(self, name, n=1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def merge(self, other):
+        '''Add the stages, counters and events of another Profile.'''
+        for name, seconds in other.seconds.items():
+            self.seconds[name] = self.seconds.get(name, 0) + seconds
+            self.calls[name] = self.calls.get(name, 0) + other.calls[name]
+        for name, n in other.counters.items():
+            self.count(name, n)
+        if self.trace:
+            room = max(0, self.max_events - len(self.events))
+            self.events.extend(other.events[:room])
+            self.dropped_events += other.dropped_events + max(0, len(other.events) - room)
+
+    def summary(self):
+        '''One row per stage and counter, with the derived rates.
+
+        Stage rows hold `calls` and `seconds`; counter rows hold `count`.
+        `comparisons` also gets the scores computed per second of the
+        `score` stage and the share skipped; each cache its hit rate.
+        '''
+        rows = [{'name': name, 'calls': self.calls[name], 'seconds': seconds}
+                for name, seconds in self.seconds.items()]
+        for name, n in sorted(self.counters.items()):
+            rows.append({'name': name, 'count': n})
+
+        scored = self.counters.get('comparisons', 0)
+        skipped = self.counters.get('comparisons_skipped', 0)
+        if self.seconds.get('score'):
+            rows.append({'name': 'scores_per_second', 'rate': scored / self.seconds['score']})
+        if scored + skipped:
+            rows.append({'name': 'comparisons_skipped_rate', 'rate': skipped / (scored + skipped)})
+        for name in sorted(self.counters):
+            if name.endswith('.hits'):
+                cache = name[:-len('.hits')]
+                total = self.counters[name] + self.counters.get(cache + '.misses', 0)
+                rows.append({'name': cache + '.hit_rate', 'rate': self.counters[name] / total})
+        return pd.DataFrame(rows, columns=['name', 'calls', 'seconds', 'count', 'rate']
+                            ).set_index('name')
+
+    def chrome_trace(self):
+        '''The stages as Chrome trace events (microseconds).'''
+        if not self.trace:
+            raise ValueError('no trace events were recorded: profile with trace=True')
+        events = [{'name': name, 'ph': 'X', 'ts': start / 1e3, 'dur': duration / 1e3,
+                   'pid': pid, 'tid': tid} for name, start, duration, pid, tid in self.events]
+        return {'traceEvents': events, 'otherData': {'counters': self.counters,
+                                                     'dropped_events': self.dropped_events}}
+
+    def write_chrome_trace(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.chrome_trace(), f)
+
+
+def stage(name):
+    '''Context manager timing a stage of the active profile, if any.'''
+    if _active is None:
+        return _disabled
+    return _Stage(_active, name)
+
+
+def count(name, n=1):
+    '''Add `n` to a counter of the active profile, if any.'''
+    if _active is not None:
+        _active.count(name, n)
+
+
+def active():
+    '''The Profile being recorded, or None.'''
+    return _active
+
+
+@contextmanager
+def enabled(profile=None, cprofile=None, trace=False):
+    '''Record into `profile` (a new `Profile(trace)` by default) within the block.
+
+    With `cprofile`, a cProfile of the block is also dumped to that path.
+    '''
+    global _active
+    previous, _active = _active, profile or Profile(trace)
+    profiler = cProfile.Profile() if cprofile else None
+    if profiler:
+        profiler.enable()
+    try:
+        yield _active
+    finally:
+        if profiler:
+            profiler.disable()
+            profiler.dump_stats(cprofile)
+        _active = previous
@@ -0,0 +1,232 @@
+'''Benchmark every FuzzyWuzzy scorer on a matching task in one pass.
+
+`evaluate_scorers` replaces running `scorer_tester_function` once per key of
+`scorer_dict`: the queries and choices are processed once per processing
+flavour and shared by all scorers, scorers run concurrently in a process
+pool, and a `ScoreCache` keeps every (scorer, query, choice) score so a re-run
+only scores the pairs it has not seen before.
+
+`score_pairs` is the row by row counterpart, for two aligned columns.
+'''
+import os
+import pickle
+import time
+
+import numpy as np
+import pandas as pd
+from fuzzywuzzy import fuzz, utils
+
+from . import profiling
+from .matching import (_ASCII_SCORERS, _INT_SCORERS, _UNICODE_SCORERS, _as_series,
+                       _pool_context, prepare_scorer)
+from .prepared import prepare, prepared_scorer
+
+
+# The abbreviations used in the notebook's scorer_dict
+SCORERS = {'R': fuzz.ratio, 'PR': fuzz.partial_ratio, 'TSeR': fuzz.token_set_ratio,
+           'TSoR': fuzz.token_sort_ratio, 'PTSeR': fuzz.partial_token_set_ratio,
+           'PTSoR': fuzz.partial_token_sort_ratio, 'WR': fuzz.WRatio,
+           'QR': fuzz.QRatio, 'UWR': fuzz.UWRatio, 'UQR': fuzz.UQRatio}
+
+
+class ScoreCache:
+    '''Scores keyed by (scorer name, query, choice), optionally kept on disk.'''
+
+    def __init__(self, path=None):
+        self.path = path
+        self.scores = {}
+        if path is not None and os.path.exists(path):
+            with open(path, 'rb') as f:
+                self.scores = pickle.load(f)
+
+    def __len__(self):
+        return len(self.scores)
+
+    def save(self, path=None):
+        path = path or self.path
+        with open(path, 'wb') as f:
+            pickle.dump(self.scores, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def _flavour(scorer):
+    '''Scorers of the same flavour see the same processed strings.'''
+    if scorer in _UNICODE_SCORERS:
+        return 'unicode'
+    if scorer in _ASCII_SCORERS:
+        return 'ascii'
+    return 'plain'
+
+
+# Called directly (with full_process), these give 0 rather than 100 for two
+# strings that both process to nothing
+_EMPTY_IS_ZERO = (fuzz.token_set_ratio, fuzz.partial_token_set_ratio)
+
+_worker = {}
+
+
+def _init_worker(scorers, processed, pairs=None):
+    _worker.update(scorers=scorers, processed=processed, pairs=pairs)
+
+
+def _score_pairs(task):
+    '''Score the (query, choice) position pairs of one scorer.'''
+    name, rows, cols = task
+    scorer = _worker['scorers'][name]
+    queries, choices = _worker['processed'][_flavour(scorer)]
+    score = prepare_scorer(scorer)[2]
+    start = time.perf_counter()
+    scores = np.array([score(queries[r], choices[c]) for r, c in zip(rows, cols)],
+                      dtype=np.int16)
+    return scores, time.perf_counter() - start
+
+
+def evaluate_scorers(queries, choices, truth, scorers=SCORERS, workers=1, cache=None,
+                     index=None):
+    '''Accuracy and wall-time of every scorer matching `queries` to `choices`.
+
+    `truth` holds, for each query, the index label in `choices` of its
+    correct match. Returns one row per scorer with the number of `correct`
+    best matches, the `accuracy`, the `seconds` spent scoring and how many
+    pairs were `scored` or served from the `cache`. With `index` (an
+    `NGramIndex` or `ChoiceIndex` over `choices`), each query is only scored
+    against its candidates, and one without any counts as wrong.
+    '''
+    queries, choices = _as_series(queries), _as_series(choices)
+    truth = _as_series(truth).to_numpy()
+    raw_queries, raw_choices = list(queries), list(choices)
+
+    processed = {}
+    with profiling.stage('process'):
+        for flavour in {_flavour(s) for s in scorers.values()}:
+            scorer = next(s for s in scorers.values() if _flavour(s) == flavour)
+            process_query, process_choice, _ = prepare_scorer(scorer, utils.full_process)
+            processed[flavour] = ([process_query(q) for q in raw_queries],
+                                  [process_choice(c) for c in raw_choices])
+
+    if index is None:
+        rows, cols = np.divmod(np.arange(len(raw_queries) * len(raw_choices)), len(raw_choices))
+    else:
+        with profiling.stage('candidates'):
+            candidates = [index.candidates(q) for q in raw_queries]
+        rows = np.repeat(np.arange(len(raw_queries)), [len(c) for c in candidates])
+        cols = np.concatenate(candidates + [np.empty(0, dtype=np.intp)]).astype(np.intp)
+        profiling.count('comparisons_skipped', (len(raw_queries) * len(raw_choices) - len(rows))
+                        * len(scorers))
+
+    # Scores of the (rows[i], cols[i]) pairs, -1 until known
+    known, tasks = {}, []
+    for name in scorers:
+        scores = np.full(len(rows), -1, dtype=np.int16)
+        if cache is not None and cache.scores:
+            get = cache.scores.get
+            scores[:] = [get((name, raw_queries[r], raw_choices[c]), -1)
+                         for r, c in zip(rows, cols)]
+        missing = scores < 0
+        if cache is not None:
+            profiling.count('score_cache.misses', int(missing.sum()))
+            profiling.count('score_cache.hits', int((~missing).sum()))
+        known[name] = scores, missing
+        tasks.append((name, rows[missing], cols[missing]))
+
+    with profiling.stage('score'):
+        if workers > 1:
+            with _pool_context().Pool(workers, _init_worker, (scorers, processed)) as pool:
+                results = pool.map(_score_pairs, tasks)
+        else:
+            _init_worker(scorers, processed)
+            results = [_score_pairs(task) for task in tasks]
+    profiling.count('comparisons', sum(len(scores) for scores, _ in results))
+
+    labels = choices.index.to_numpy()
+    report = []
+    for (name, task_rows, task_cols), (new, seconds) in zip(tasks, results):
+        scores, missing = known[name]
+        scores[missing] = new
+        if cache is not None:
+            for r, c, s in zip(task_rows, task_cols, new):
+                cache.scores[(name, raw_queries[r], raw_choices[c])] = int(s)
+
+        # Best pair of every row, ties to the lowest column like select_top_k
+        order = np.lexsort((cols, -scores, rows))
+        best = order[np.r_[True, rows[order][1:] != rows[order][:-1]]] if len(order) else order
+        correct = int((labels[cols[best]] == truth[rows[best]]).sum())
+        report.append({'scorer': name, 'correct': correct,
+                       'accuracy': correct / len(raw_queries), 'seconds': seconds,
+                       'scored': len(new), 'cached': len(scores) - len(new)})
+
+    if cache is not None and cache.path is not None:
+        cache.save()
+    return pd.DataFrame(report).set_index('scorer')
+
+
+def _score_batch(task):
+    '''Score one batch of the aligned pairs with one scorer.'''
+    name, start, stop = task
+    scorer = _worker['scorers'][name]
+    left, right = _worker['processed'][_flavour(scorer)]
+    score = prepared_scorer(scorer)
+    rows, cols = _worker['pairs']
+    pairs = zip(rows[start:stop], cols[start:stop])
+    if scorer in _EMPTY_IS_ZERO:
+        return [score(left[r], right[c]) if left[r].processed and right[c].processed else 0
+                for r, c in pairs]
+    return [score(left[r], right[c]) for r, c in pairs]
+
+
+def score_pairs(a, b, scorers=SCORERS, batch_size=2 ** 16, workers=1):
+    '''Score every aligned pair `(a[i], b[i])` with each scorer in one call.
+
+    Gives the same scores as calling `scorer(a[i], b[i])` row by row, but
+    each distinct string is processed and tokenized once per processing
+    flavour and shared by all scorers, and each distinct pair is scored
+    once. `scorers` is a dict of names to scorers (`scorer_dict`) or a list
+    of scorers. The pairs are scored in batches of `batch_size`, spread over
+    a pool of `workers` processes.
+
+    Returns a frame indexed like `a` with one column per scorer. Pairs with
+    a missing value score 0, as the fuzz scorers give for None.
+    '''
+    a, b = _as_series(a), _as_series(b)
+    if len(a) != len(b):
+        raise ValueError('a and b must have the same length, not %d and %d' % (len(a), len(b)))
+    if not isinstance(scorers, dict):
+        scorers = {getattr(s, '__name__', repr(s)): s for s in scorers}
+
+    present = np.flatnonzero(~(a.isna() | b.isna()).to_numpy())
+    left_codes, left_values = pd.factorize(a.to_numpy()[present])
+    right_codes, right_values = pd.factorize(b.to_numpy()[present])
+    pair_codes, pairs = pd.factorize(left_codes.astype(np.int64) * len(right_values)
+                                     + right_codes)
+    rows, cols = np.divmod(pairs, max(len(right_values), 1))
+
+    processed = {}
+    with profiling.stage('process'):
+        for flavour in {_flavour(s) for s in scorers.values()}:
+            scorer = next(s for s in scorers.values() if _flavour(s) == flavour)
+            process = prepare_scorer(scorer, None)[1]
+            processed[flavour] = ([prepare(process(v)) for v in left_values],
+                                  [prepare(process(v)) for v in right_values])
+
+    tasks = [(name, start, start + batch_size) for name in scorers
+             for start in range(0, len(pairs), batch_size)]
+    with profiling.stage('score'):
+        if workers > 1 and len(tasks) > 1:
+            with _pool_context().Pool(workers, _init_worker,
+                                      (scorers, processed, (rows, cols))) as pool:
+                results = pool.map(_score_batch, tasks)
+        else:
+            _init_worker(scorers, processed, (rows, cols))
+            results = [_score_batch(task) for task in tasks]
+    profiling.count('comparisons', len(pairs) * len(scorers))
+    profiling.count('comparisons_skipped', (len(a) - len(pairs)) * len(scorers))
+
+    columns, done = {}, 0
+    for name, scorer in scorers.items():
+        batches = results[done:done + len(range(0, len(pairs), batch_size))]
+        done += len(batches)
+        dtype = np.int16 if scorer in _INT_SCORERS else np.float32
+        unique = np.array([s for batch in batches for s in batch], dtype=dtype)
+        column = np.zeros(len(a), dtype=dtype)
+        column[present] = unique[pair_codes]
+        columns[name] = column
+    return pd.DataFrame(columns, index=a.index)
@@ -0,0 +1,186 @@
+'''Name -> email lookup served over asyncio, with request micro-batching.
+
+`MatchService` holds the prepared choices in memory. Concurrent lookups that
+arrive within `window` seconds of each other (up to `max_batch` of them) are
+matched together by one `match_columns` call, which runs in an executor so
+the event loop keeps accepting requests meanwhile. If that call fails, the
+names of the batch are matched one by one, so only the bad ones get an error.
+
+The wire protocol is one JSON object per line: the client sends
+`{"name": "Rocio E. Thatch"}` and gets back `{"matches": [{"match": ...,
+"similarity": ..., "choice_index": ...}, ...]}` (or `{"error": ...}`).
+
+    python -m fuzzy_match.service serve --index it_index
+    python -m fuzzy_match.service loadgen --names data/hr.csv --column full_name
+'''
+import argparse
+import asyncio
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from .index import ChoiceIndex
+from .matching import match_columns
+
+
+def _plain(value):
+    return value.item() if hasattr(value, 'item') else value
+
+
+class MatchService:
+    '''Batches concurrent lookups into vectorized match_columns calls.'''
+
+    def __init__(self, choices, top_k=3, window=0.005, max_batch=256, executor=None,
+                 **kwargs):
+        self.choices = choices
+        self.top_k = top_k
+        self.window = window
+        self.max_batch = max_batch
+        # One thread: the prepared choices' query cache is not thread-safe
+        self.executor = executor or ThreadPoolExecutor(1)
+        self.kwargs = kwargs
+        self.queue = None
+        self.batches = self.requests = 0
+
+    def _match(self, names):
+        matches = match_columns(pd.Series(names), self.choices, top_k=self.top_k, **self.kwargs)
+        results = [[] for _ in names]
+        for row, match, similarity, choice_index in zip(
+                matches.index, matches['match'], matches['similarity'], matches['choice_index']):
+            results[row].append({'match': _plain(match), 'similarity': _plain(similarity),
+                                 'choice_index': _plain(choice_index)})
+        return results
+
+    async def _batcher(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            deadline = loop.time() + self.window
+            while len(batch) < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            names = [name for name, _ in batch]
+            try:
+                results = await loop.run_in_executor(self.executor, self._match, names)
+            except Exception:
+                # Match one name at a time so a bad query only fails itself
+                results = None
+            self.batches += 1
+            self.requests += len(batch)
+            for i, (name, future) in enumerate(batch):
+                try:
+                    result = (results[i] if results is not None else
+                              (await loop.run_in_executor(self.executor, self._match, [name]))[0])
+                except Exception as error:
+                    if not future.done():
+                        future.set_exception(error)
+                    continue
+                if not future.done():
+                    future.set_result(result)
+
+    async def start(self):
+        self.queue = asyncio.Queue()
+        self._task = asyncio.create_task(self._batcher())
+
+    async def stop(self):
+        self._task.cancel()
+
+    async def lookup(self, name):
+        '''Top-k matches of one name.'''
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((name, future))
+        return await future
+
+    async def handle(self, reader, writer):
+        '''Serve one client connection, one JSON request per line.'''
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    name = json.loads(line)['name']
+                except (ValueError, KeyError, TypeError):
+                    name = None
+                if not isinstance(name, str):
+                    reply = {'error': 'expected a JSON object with a string "name"'}
+                else:
+                    try:
+                        reply = {'matches': await self.lookup(name)}
+                    except Exception as error:
+                        reply = {'error': str(error)}
+                writer.write(json.dumps(reply).encode('utf-8') + b'\n')
+                await writer.drain()
+        finally:
+            writer.close()
+
+
+async def serve(service, host='127.0.0.1', port=8765):
+    await service.start()
+    server = await asyncio.start_server(service.handle, host, port)
+    async with server:
+        await server.serve_forever()
+
+
+async def loadgen(names, host='127.0.0.1', port=8765, concurrency=32, requests=1000):
+    '''Send `requests` lookups over `concurrency` connections; report latencies.'''
+    latencies = []
+
+    async def client(count):
+        reader, writer = await asyncio.open_connection(host, port)
+        for i in range(count):
+            name = names[(len(latencies) + i) % len(names)]
+            start = time.perf_counter()
+            writer.write(json.dumps({'name': name}).encode('utf-8') + b'\n')
+            await writer.drain()
+            await reader.readline()
+            latencies.append(time.perf_counter() - start)
+        writer.close()
+
+    per_client = [requests // concurrency + (i < requests % concurrency)
+                  for i in range(concurrency)]
+    start = time.perf_counter()
+    await asyncio.gather(*(client(n) for n in per_client if n))
+    elapsed = time.perf_counter() - start
+
+    ms = np.array(latencies) * 1000
+    return {'requests': len(ms), 'seconds': elapsed, 'per_second': len(ms) / elapsed,
+            'p50_ms': float(np.percentile(ms, 50)), 'p99_ms': float(np.percentile(ms, 99))}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('command', choices=['serve', 'loadgen'])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--index', help='ChoiceIndex directory to serve')
+    parser.add_argument('--top-k', type=int, default=3)
+    parser.add_argument('--window', type=float, default=0.005)
+    parser.add_argument('--names', help='CSV file with the names to send')
+    parser.add_argument('--column', default='full_name')
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--requests', type=int, default=1000)
+    args = parser.parse_args(argv)
+
+    if args.command == 'serve':
+        index = ChoiceIndex(args.index)
+        service = MatchService(index, top_k=args.top_k, window=args.window, index=index)
+        asyncio.run(serve(service, args.host, args.port))
+    else:
+        names = list(pd.read_csv(args.names, encoding='unicode_escape')[args.column])
+        report = asyncio.run(loadgen(names, args.host, args.port, args.concurrency,
+                                     args.requests))
+        print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
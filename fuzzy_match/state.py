@@ -0,0 +1,148 @@
+'''Persisted match state, so a change on either side only re-scores what it touches.
+
+`MatchState` keeps, for every query key (e.g. `hr.employee_id`), its best
+choice key and score, along with the choice set they were computed against.
+`update` diffs new query and choice columns against that state:
+
+* new or edited queries are matched against every choice;
+* removed (or edited) choices only invalidate the queries pointing at them,
+  which are matched again against every choice;
+* new (or edited) choices are scored against the remaining queries and
+  replace their best match when they beat it;
+* if the unchanged choices come in a different order, every query is
+  matched again, since a tie goes to the choice coming first.
+
+The result is the same as a full `match_columns` run on the new columns,
+ties included. With `blocking`, each pass is blocked by an `NGramIndex`
+built over the choices it scores, so the result is as good as blocking
+recall allows rather than exactly that of a full run.
+'''
+import os
+import pickle
+
+import numpy as np
+import pandas as pd
+from fuzzywuzzy import fuzz
+
+from .blocking import NGramIndex
+from .matching import match_columns
+
+
+class MatchState:
+    '''Best match of every query, kept up to date incrementally.
+
+    `queries` and `choices` passed to `update` are Series indexed by a
+    unique key. Extra keyword arguments go to `match_columns`, except
+    `index`: a blocking index is tied to the positions of one choice column,
+    so pass the `NGramIndex` arguments as `blocking` (e.g.
+    `blocking={'limit': 20}`) and an index is built over the choices of
+    every pass.
+    '''
+
+    def __init__(self, path=None, scorer=fuzz.WRatio, blocking=None, **kwargs):
+        if 'index' in kwargs:
+            raise ValueError('MatchState builds its own blocking indexes: pass the '
+                             'NGramIndex arguments as blocking={...} instead of index')
+        self.path = path
+        self.scorer = scorer
+        self.blocking = blocking
+        self.kwargs = kwargs
+        self.version = 0
+        self.queries = pd.Series(dtype=object)
+        self.choices = pd.Series(dtype=object)
+        self.best = pd.DataFrame(columns=['choice_key', 'similarity', 'version'])
+        self.scored = 0
+
+    @classmethod
+    def load(cls, path, **kwargs):
+        '''Open the state saved at `path`, or start a new one there.'''
+        if not os.path.exists(path):
+            return cls(path, **kwargs)
+        with open(path, 'rb') as f:
+            state = pickle.load(f)
+        state.path = path
+        return state
+
+    def save(self, path=None):
+        path = path or self.path
+        tmp = path + '.tmp'
+        with open(tmp, 'wb') as f:
+            pickle.dump(self, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, path)
+
+    def _match(self, queries, choices):
+        kwargs = dict(self.kwargs)
+        candidates = len(choices)
+        if getattr(self, 'blocking', None) is not None:
+            kwargs['index'] = NGramIndex(choices, **self.blocking)
+            if kwargs['index'].limit is not None:
+                candidates = min(candidates, kwargs['index'].limit)
+        self.scored += len(queries) * candidates
+        return match_columns(queries, choices, scorer=self.scorer, top_k=1, **kwargs)
+
+    def update(self, queries, choices):
+        '''Bring the state in line with new `queries` and `choices`.
+
+        Returns the number of (query, choice) pairs that had to be scored
+        (with `blocking`, at most that many).
+        '''
+        if not queries.index.is_unique or not choices.index.is_unique:
+            raise ValueError('queries and choices must be indexed by unique keys')
+        self.scored = 0
+        old_queries, old_choices = self.queries, self.choices
+        common = choices.index.intersection(old_choices.index)
+        unchanged = common[choices[common].to_numpy() == old_choices[common].to_numpy()]
+        added = choices.index.difference(unchanged, sort=False)
+        removed = old_choices.index.difference(unchanged, sort=False)
+        if len(added) or len(removed):
+            self.version += 1
+        # Ties go to the choice coming first, so a new order can change any match
+        new_positions = choices.index.get_indexer(unchanged)
+        old_positions = old_choices.index.get_indexer(unchanged)
+        reordered = bool((np.diff(old_positions[np.argsort(new_positions)]) < 0).any())
+
+        # Queries that need a full run: new, edited, or pointing at a removed choice
+        best = self.best.reindex(queries.index)
+        edited = old_queries.reindex(queries.index).to_numpy() != queries.to_numpy()
+        stale = (best['choice_key'].isna().to_numpy() | edited | reordered
+                 | best['choice_key'].isin(removed).to_numpy())
+        rerun, keep = queries.index[stale], queries.index[~stale]
+
+        rows = []
+        if len(rerun):
+            matches = self._match(queries[rerun], choices)
+            rows.append(pd.DataFrame({'choice_key': matches['choice_index'],
+                                      'similarity': matches['similarity']},
+                                     index=matches.index))
+
+        kept = best.loc[keep, ['choice_key', 'similarity']]
+        if len(keep) and len(added):
+            new = self._match(queries[keep], choices[added])
+            position = pd.Series(np.arange(len(choices)), index=choices.index)
+            old_score = kept['similarity'].reindex(new.index).to_numpy()
+            old_position = position[kept['choice_key'].reindex(new.index)].to_numpy()
+            new_position = position[new['choice_index']].to_numpy()
+            better = ((new['similarity'].to_numpy() > old_score)
+                      | ((new['similarity'].to_numpy() == old_score)
+                         & (new_position < old_position)))
+            winners = new[better]
+            kept.loc[winners.index, 'choice_key'] = winners['choice_index'].to_numpy()
+            kept.loc[winners.index, 'similarity'] = winners['similarity'].to_numpy()
+        rows.append(kept)
+
+        self.best = pd.concat(rows).reindex(queries.index)
+        self.best['version'] = self.version
+        self.queries, self.choices = queries.copy(), choices.copy()
+        if self.path is not None:
+            self.save()
+        return self.scored
+
+    def matches(self):
+        '''Current best match of every query.'''
+        return pd.DataFrame({
+            'query': self.queries,
+            'match': self.choices.reindex(self.best['choice_key']).to_numpy(),
+            'choice_key': self.best['choice_key'],
+            'similarity': self.best['similarity'],
+            'version': self.best['version'],
+        })
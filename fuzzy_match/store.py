@@ -0,0 +1,135 @@
+'''Choice columns kept in a few flat arrays instead of millions of Python objects.
+
+A `PreparedChoices` holds, for every choice, its raw value in a Series and a
+`Prepared` namedtuple of two strings and a frozenset of tokens: several
+hundred bytes of Python objects per username. A `StringStore` keeps strings
+back to back in one UTF-8 buffer plus an offsets array. `CompactChoices`
+keeps the raw and processed choices that way and interns their tokens: each
+token is an id into one sorted vocabulary, and the ids of every choice are
+stored sorted in one flat array, so they spell its sorted-token string.
+
+Matching reads the arrays directly: the character histograms of the ratio
+bounds are built from the buffer in one pass, and a choice is only decoded
+into a `Prepared` when it is actually scored.
+'''
+import os
+
+import numpy as np
+from fuzzywuzzy import fuzz, utils
+
+from .bounds import CharHistograms
+from .matching import _as_series
+from .prepared import Prepared, PreparedChoices
+
+
+class StringStore:
+    '''Strings stored back to back in one UTF-8 buffer plus an offsets array.'''
+
+    def __init__(self, buffer, offsets):
+        self.buffer = buffer
+        self.offsets = offsets
+
+    @classmethod
+    def from_strings(cls, strings):
+        encoded = [s.encode('utf-8') for s in strings]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(e) for e in encoded], out=offsets[1:])
+        return cls(np.frombuffer(b''.join(encoded), dtype=np.uint8), offsets)
+
+    def save(self, directory, name):
+        np.save(os.path.join(directory, name + '.buffer.npy'), self.buffer)
+        np.save(os.path.join(directory, name + '.offsets.npy'), self.offsets)
+
+    @classmethod
+    def open(cls, directory, name):
+        '''Memory-map a store written by `save`.'''
+        return cls(np.load(os.path.join(directory, name + '.buffer.npy'), mmap_mode='r'),
+                   np.load(os.path.join(directory, name + '.offsets.npy'), mmap_mode='r'))
+
+    @property
+    def nbytes(self):
+        return self.buffer.nbytes + self.offsets.nbytes
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        return self.buffer[self.offsets[i]:self.offsets[i + 1]].tobytes().decode('utf-8')
+
+    def take(self, positions):
+        '''Object array of the strings at `positions`.'''
+        return np.array([self[p] for p in np.asarray(positions).ravel()], dtype=object)
+
+    def joined(self):
+        '''All strings concatenated, with the length of each in characters.'''
+        lead = np.concatenate([[0], np.cumsum((self.buffer & 0xC0) != 0x80)])
+        return self.buffer.tobytes().decode('utf-8'), np.diff(lead[self.offsets])
+
+
+def intern_tokens(strings):
+    '''(vocabulary, ids, indptr) of the whitespace tokens of `strings`.
+
+    `vocabulary` is sorted, so the ids of string i,
+    `ids[indptr[i]:indptr[i + 1]]`, are sorted like its tokens.
+    '''
+    tokens = [s.split() for s in strings]
+    vocabulary = sorted({t for ts in tokens for t in ts})
+    lookup = {t: i for i, t in enumerate(vocabulary)}
+    ids = np.fromiter((lookup[t] for ts in tokens for t in sorted(ts)), dtype=np.uint32,
+                      count=sum(len(ts) for ts in tokens))
+    indptr = np.zeros(len(tokens) + 1, dtype=np.int64)
+    np.cumsum([len(ts) for ts in tokens], out=indptr[1:])
+    return vocabulary, ids, indptr
+
+
+class _Items:
+    '''Lazy sequence of the Prepared choices of a CompactChoices.'''
+
+    def __init__(self, choices):
+        self.processed = choices.processed
+        self.vocabulary = choices.vocabulary
+        self.ids = choices.token_ids
+        self.indptr = choices.token_indptr
+
+    def __len__(self):
+        return len(self.processed)
+
+    def __getitem__(self, position):
+        tokens = [self.vocabulary[i]
+                  for i in self.ids[self.indptr[position]:self.indptr[position + 1]]]
+        return Prepared(self.processed[position], ' '.join(tokens), frozenset(tokens))
+
+    def __iter__(self):
+        return (self[p] for p in range(len(self)))
+
+
+class CompactChoices(PreparedChoices):
+    '''A PreparedChoices held in flat arrays (raw values are kept as strings).'''
+
+    def __init__(self, choices, scorer=fuzz.WRatio, processor=utils.full_process,
+                 cache_size=2 ** 16):
+        choices = _as_series(choices)
+        process_choice = self._setup(scorer, processor, cache_size)
+        self.index = choices.index
+        self.raw = StringStore.from_strings(str(c) for c in choices)
+        processed = [process_choice(c) for c in choices]
+        self.processed = StringStore.from_strings(processed)
+        self.vocabulary, self.token_ids, self.token_indptr = intern_tokens(processed)
+        self.items = _Items(self)
+
+    @property
+    def nbytes(self):
+        '''Bytes held by the arrays (the vocabulary strings aside).'''
+        return (self.raw.nbytes + self.processed.nbytes + self.token_ids.nbytes
+                + self.token_indptr.nbytes)
+
+    def values(self, positions):
+        return self.raw.take(positions)
+
+    def labels(self, positions):
+        return self.index.to_numpy()[positions]
+
+    def char_histograms(self, sorted_tokens):
+        if not sorted_tokens and False not in self._histograms:
+            self._histograms[False] = CharHistograms(None, *self.processed.joined())
+        return super().char_histograms(sorted_tokens)
@@ -0,0 +1,117 @@
+'''Match a query CSV that does not fit in memory, chunk by chunk.
+
+Only the prepared choices and one chunk of queries are held in memory. The
+matches of every chunk are written out as soon as they are computed and a
+checkpoint file records the last completed chunk, so an interrupted run
+picks up where it stopped.
+'''
+import json
+import os
+import shutil
+
+import pandas as pd
+from fuzzywuzzy import fuzz, utils
+
+from . import profiling
+from .matching import match_columns
+from .prepared import PreparedChoices
+from .store import CompactChoices
+
+
+def _read_checkpoint(path, run):
+    '''Checkpoint at `path`, which must have been written by the same `run`.'''
+    if not os.path.exists(path):
+        return dict(run, chunks=0, bytes=0)
+    with open(path) as f:
+        state = json.load(f)
+    changed = [key for key, value in run.items() if state.get(key) != value]
+    if changed:
+        raise ValueError('%s was written for a different %s (%s); resume with the same '
+                         'values or pass resume=False'
+                         % (path, ' and '.join(changed),
+                            ', '.join('%s=%r' % (key, state.get(key)) for key in changed)))
+    return state
+
+
+def _write_checkpoint(path, state):
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(state, f)
+    os.replace(tmp, path)
+
+
+def _timed(chunks):
+    '''Yield the chunks of a CSV reader, timing the decode of each.'''
+    chunks = iter(chunks)
+    while True:
+        with profiling.stage('read_csv'):
+            chunk = next(chunks, None)
+        if chunk is None:
+            return
+        yield chunk
+
+
+def match_csv(path, column, choices, output, chunksize=100000, resume=True,
+              scorer=fuzz.WRatio, processor=utils.full_process,
+              encoding='unicode_escape', **kwargs):
+    '''Match `column` of the CSV at `path` against `choices`, writing to `output`.
+
+    `choices` is a column or a `PreparedChoices` (a `CompactChoices`
+    prepared for `scorer` is built otherwise). Each output row holds the
+    query's row number (`row`), the query and the columns returned by
+    `match_columns(**kwargs)`. An `output` ending in `.parquet` is a
+    directory of one part file per chunk, anything else is a single CSV
+    file that is appended to.
+
+    With `resume` the chunks recorded in `output + '.checkpoint'` are skipped
+    (a partially written CSV is truncated to the last checkpoint first);
+    otherwise any previous output is discarded. The checkpoint records the
+    input `path`, `column` and `chunksize`, and resuming with different ones
+    raises a ValueError, since chunk numbers would no longer map to the same
+    rows. Returns the number of chunks matched by this call.
+    '''
+    if not isinstance(choices, PreparedChoices):
+        choices = CompactChoices(choices, scorer, processor)
+    parquet = output.endswith('.parquet')
+    checkpoint = output + '.checkpoint'
+
+    if not resume:
+        if os.path.isdir(output):
+            shutil.rmtree(output)
+        for stale in (output, checkpoint):
+            if os.path.isfile(stale):
+                os.remove(stale)
+    state = _read_checkpoint(checkpoint, {'path': os.path.abspath(path), 'column': column,
+                                          'chunksize': chunksize})
+
+    if parquet:
+        os.makedirs(output, exist_ok=True)
+    elif os.path.exists(output):
+        with open(output, 'r+b') as f:
+            f.truncate(state['bytes'])
+
+    done = 0
+    reader = pd.read_csv(path, usecols=[column], chunksize=chunksize, encoding=encoding)
+    for number, chunk in enumerate(_timed(reader)):
+        if number < state['chunks']:
+            continue
+
+        matches = match_columns(chunk[column], choices, **kwargs)
+        matches.insert(0, column, chunk[column].reindex(matches.index).to_numpy())
+        matches.insert(0, 'row', matches.index)
+
+        with profiling.stage('write'):
+            if parquet:
+                matches.to_parquet(os.path.join(output, 'part-%05d.parquet' % number),
+                                   index=False)
+            else:
+                with open(output, 'a', newline='', encoding='utf-8') as f:
+                    matches.to_csv(f, header=state['bytes'] == 0, index=False)
+                    f.flush()
+                    os.fsync(f.fileno())
+                    state['bytes'] = f.tell()
+
+        state['chunks'] = number + 1
+        _write_checkpoint(checkpoint, state)
+        done += 1
+    return done
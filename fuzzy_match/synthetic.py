@@ -0,0 +1,99 @@
+'''Synthetic hr/it datasets of any size, with known true matches.
+
+Names are built from random syllables so millions of them can be generated
+without a name list. Every employee gets a username in the style of
+`data/it.csv` (`l.kane`, `catkison`) and the data is made noisy the way the
+notebook's is: middle names, abbreviated middle names ("Rocio E. Thatch")
+and typos in the names, usernames without the dot or the initial.
+'''
+import numpy as np
+import pandas as pd
+
+
+_ONSETS = ['b', 'c', 'd', 'f', 'g', 'h', 'j', 'k', 'l', 'm', 'n', 'p', 'r', 's', 't',
+           'v', 'w', 'z', 'br', 'ch', 'cl', 'dr', 'gr', 'sh', 'st', 'th', 'tr', '']
+_NUCLEI = ['a', 'e', 'i', 'o', 'u', 'ai', 'ea', 'ee', 'ie', 'oo', 'ou', 'y']
+_CODAS = ['', '', 'n', 'r', 'l', 's', 'th', 'ck', 'm', 'nd', 'rt', 'x']
+
+DOMAIN = '@giantbabybibs.org'
+
+# Share of the HR rows affected by each kind of noise
+NOISE = {'middle': .15, 'abbreviated': .05, 'dropped_initial': .03, 'typo': .10,
+         'no_dot': .20}
+
+
+def _words(rng, n, syllables=(2, 3)):
+    counts = rng.integers(syllables[0], syllables[1] + 1, size=n)
+    parts = [rng.choice(_ONSETS, size=n), rng.choice(_NUCLEI, size=n),
+             rng.choice(_CODAS, size=n)]
+    words = [''.join(p) for p in zip(*parts)]
+    for extra in range(1, syllables[1]):
+        more = counts > extra
+        tail = [''.join(p) for p in zip(rng.choice(_ONSETS, size=n),
+                                        rng.choice(_NUCLEI, size=n))]
+        words = [w + t if m else w for w, t, m in zip(words, tail, more)]
+    return [w.capitalize() for w in words]
+
+
+def _typo(rng, word):
+    if len(word) < 3:
+        return word
+    i = int(rng.integers(1, len(word) - 1))
+    kind = rng.integers(3)
+    if kind == 0:
+        return word[:i] + word[i + 1:]
+    if kind == 1:
+        return word[:i] + word[i + 1] + word[i] + word[i + 2:]
+    return word[:i] + chr(ord('a') + int(rng.integers(26))) + word[i + 1:]
+
+
+def generate(rows, seed=0, noise=NOISE):
+    '''Return (hr, it) frames of `rows` employees and their IT accounts.
+
+    `hr` has `employee_id`, `full_name` and the true `username`; `it` has
+    the `email` of every employee in random order plus the bare `username`.
+    '''
+    rng = np.random.default_rng(seed)
+    first, last, middle = _words(rng, rows), _words(rng, rows), _words(rng, rows)
+
+    usernames, taken = [], set()
+    no_dot = rng.random(rows) < noise.get('no_dot', 0)
+    no_initial = rng.random(rows) < noise.get('dropped_initial', 0)
+    for f, l, nd, ni in zip(first, last, no_dot, no_initial):
+        base = (l if ni else f[0] + ('' if nd else '.') + l).lower()
+        name, suffix = base, 1
+        while name in taken:
+            suffix += 1
+            name = '%s%d' % (base, suffix)
+        taken.add(name)
+        usernames.append(name)
+
+    names = []
+    draws = rng.random((rows, 3))
+    for i in range(rows):
+        f, l = first[i], last[i]
+        if draws[i, 0] < noise.get('typo', 0):
+            l = _typo(rng, l)
+        if draws[i, 1] < noise.get('abbreviated', 0):
+            name = '%s %s. %s' % (f, middle[i][0], l)
+        elif draws[i, 2] < noise.get('middle', 0):
+            name = '%s %s %s' % (f, middle[i], l)
+        else:
+            name = '%s %s' % (f, l)
+        names.append(name)
+
+    # Multiplying by an odd constant is a bijection modulo 2**32: unique ids
+    ids = (np.arange(rows, dtype=np.uint64) * np.uint64(2654435761) + np.uint64(seed)) \
+        % np.uint64(2 ** 32)
+    hr = pd.DataFrame({'employee_id': ['%08X' % i for i in ids],
+                       'full_name': names, 'username': usernames})
+    it = pd.DataFrame({'username': np.array(usernames, dtype=object)[rng.permutation(rows)]})
+    it.insert(0, 'email', it['username'] + DOMAIN)
+    return hr, it
+
+
+def documents(count, words=350, seed=0, vocabulary=2000):
+    '''Random documents of about `words` words, for the long-text scorers.'''
+    rng = np.random.default_rng(seed)
+    vocab = np.array([w.lower() for w in _words(rng, vocabulary, (1, 3))])
+    return [' '.join(rng.choice(vocab, size=words)) for _ in range(count)]
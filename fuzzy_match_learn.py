@@ -100,6 +100,13 @@ print("Partial Ratio:",Partial_Ratio)
 print("Token Sort Ratio:",Token_Sort_Ratio)
 print("Token Set Ratio:",Token_Set_Ratio)
 # %%
+#the same comparison in linear time with MinHash, for de-duplicating many long summaries
+from fuzzy_match.minhash import near_duplicates, similarity
+
+print("MinHash Token Set Similarity:",similarity(input_text,output_text))
+print("MinHash Jaccard Similarity:",similarity(input_text,output_text,kind='jaccard'))
+print(near_duplicates([input_text,output_text,input_text.replace('Text','text')],threshold=0.4))
+# %%
 #choosing the possible string match
 
 #using process library
@@ -8,9 +8,16 @@ https://github.com/kelmouloudi/MediumArticle-FuzzyWuzzy
 from IPython import get_ipython
 
 # %%
+import os
+
 import pandas as pd
 from fuzzywuzzy import process, fuzz
 import matplotlib.pyplot as plt
+from fuzzy_match import match_columns, match_with_confidence
+from fuzzy_match.assignment import one_to_one_match
+from fuzzy_match.blocking import NGramIndex, blocking_recall
+from fuzzy_match.pipeline import Stage, cascade_match, two_stage_match
+from fuzzy_match.scorers import ScoreCache, evaluate_scorers, score_pairs
 
 # %%
 hr = pd.read_csv('data/hr.csv', encoding='unicode_escape')
@@ -28,7 +35,8 @@ hr.head(3)
 
 # %%
 # Now let's check if the gen_email values exist in the actual email list
-hr['exists'] = hr.apply(lambda x: x.gen_email in list(it.email), axis=1)
+# (isin hashes it.email once instead of rebuilding and scanning list(it.email) for every row)
+hr['exists'] = hr.gen_email.isin(it.email)
 hr.head(5)
 
 # %% 
@@ -57,20 +65,29 @@ it.head(3)
 # %%
 
 '''Now let's use process.extract to compare hr.full_name to it.username (note that we added the domaine name @giantbabybibs.org AFTER calculating the ratios):'''
-actual_email = []
-similarity = []
-
-for i in hr.full_name:
-        ratio = process.extract( i, it.username, limit=1)
-        actual_email.append(ratio[0][0])
-        similarity.append(ratio[0][1])
+# match_columns gives the same result as calling process.extract( i, it.username, limit=1)
+# for every i in hr.full_name, but scores whole blocks of names at once.
+# On a big dataframe, pass workers=os.cpu_count() to spread the names over all cores
+matches = match_columns( hr.full_name, it.username, top_k=1)
 
-hr['actual_email'] = pd.Series(actual_email)
-hr['actual_email'] = hr['actual_email'] + '@giantbabybibs.org'
-hr['similarity'] = pd.Series(similarity)
+hr['actual_email'] = matches['match'] + '@giantbabybibs.org'
+hr['similarity'] = matches['similarity']
 
 hr.head()
 
+# %%
+'''Most of those comparisons are hopeless ('Kortney Lapierre Brazee' vs 'l.kane'). A trigram blocking index
+only lets the usernames sharing the most trigrams with a name through to the scorer. `limit` trades recall for speed,
+and blocking_recall tells us how many matches we lose compared to scoring every pair:'''
+for limit in (5, 20, 50):
+    print(limit, blocking_recall( hr.full_name, it.username, NGramIndex(it.username, limit=limit) ))
+
+# %%
+'''The dumb strategy already finds most emails. two_stage_match keeps those exact hits and only sends the
+remaining names to the fuzzy matcher:'''
+two_stage = two_stage_match( hr.full_name, it.username, hr.gen_email, it.email)
+two_stage.method.value_counts()
+
 # %%
 final_result = hr[['full_name', 'actual_email', 'similarity']]
 final_result.head()
@@ -93,6 +110,12 @@ final_result[final_result['full_name'].str.contains('.', regex=False)]
 '''The process got all of the 4 employees wrong. Even though that's only 4 wrongs out of 200, which means a success rate of 98%'''
 
 
+# %%
+'''match_with_confidence also returns the runner-up of every match and the margin between the two, from the same pass.
+All 4 of these employees are a tie between two usernames, so they come out flagged as ambiguous:'''
+confidence = match_with_confidence( hr.full_name, it.username)
+confidence[confidence.ambiguous]
+
 # %% [markdown]
 # Now would you look at that! The process got all of the 4 employees wrong. Even though that's only **4 wrongs** out of **200**, which means a **success rate of 98%**, imagine if you have 173.000 employees in the dataframe (for a company like General Motors for example), that would mean **3460 wrong emails**.
 # 
@@ -150,18 +173,11 @@ scorer_test.head()
 
 # %%
 def scorer_tester_function(x) :
-    actual_email = []
-    similarity = []
-    
-    for i in scorer_test['full_name']:
-        ratio = process.extract( i, it.username, limit=1, scorer=scorer_dict[x])
-        actual_email.append( ratio[0][0] )
-        similarity.append( ratio[0][1] )
-
-        scorer_test['actual_email'] = pd.Series(actual_email)
-        scorer_test['actual_email'] = scorer_test['actual_email'] + '@giantbabybibs.org'
-        scorer_test['similarity'] = pd.Series(similarity)
-        
+    matches = match_columns( scorer_test['full_name'], it.username, scorer=scorer_dict[x])
+
+    scorer_test['actual_email'] = matches['match'] + '@giantbabybibs.org'
+    scorer_test['similarity'] = matches['similarity']
+
     return scorer_test
 
 # %% [markdown]
@@ -172,6 +188,12 @@ def scorer_tester_function(x) :
 scorer_tester_function('WR')
 scorer_test[scorer_test.full_name.str.contains('.', regex=False)]
 
+# %%
+'''Some of these employees were given the same email as someone else. one_to_one_match assigns the WRatio candidates
+so that no email is used twice and the total similarity is the highest; rank > 0 means a row gave up its own best match:'''
+assigned = one_to_one_match( scorer_test['full_name'], it.username, scorer=fuzz.WRatio)
+assigned[assigned['rank'] > 0].join(scorer_test['full_name'])
+
 # %% [markdown]
 # As we can see, **fuzz.WRatio (WR)** performs badly with full names having an abbreviated middle name. Let's see if other scorers will correct this, **fuzz.ratio (R)** for example :
 
@@ -193,7 +215,22 @@ display(scorer_test[81:82])
 # %% [markdown]
 # Finally! After manually checking all other records, I hereby announce **fuzz.partial_ratio (PR)** the champion with **100% success rate**. The quest is over guys!
 
-# 
+# %%
+'''Instead of one full run per scorer, evaluate_scorers scores all of them in one go (in parallel, only against
+the blocked candidates, and caching every score so that re-runs are incremental). We use the partial_ratio
+matches we just checked as the truth:'''
+truth = match_columns( hr.full_name, it.username, scorer=fuzz.partial_ratio)['choice_index']
+evaluate_scorers( hr.full_name, it.username, truth, scorers=scorer_dict, workers=os.cpu_count(),
+                  cache=ScoreCache('scorer_cache.pkl'), index=NGramIndex(it.username, limit=50) )
+
+# %%
+'''partial_ratio is also one of the slowest scorers. cascade_match gets its accuracy for close to the cost of fuzz.ratio:
+ratio keeps the 10 best usernames of every name, and only the names where ratio isn't sure (score under 90 or a
+margin under 10 points) get their 10 candidates re-scored with partial_ratio:'''
+cascade = cascade_match( hr.full_name, it.username, stages=[Stage(fuzz.ratio, 90, 10), Stage(fuzz.partial_ratio)])
+cascade.stage.value_counts()
+
+# %% [markdown]
 # In real world applications, you may be working with huge amounts of data, in which case manually inspecting the results is not an option. That's why you need to understand what each `FuzzyWuzzy` scorer does in order to choose the one that works best for the kind of data you're handling.
 # 
 # To explore the differences between the scorers `FuzzyWuzzy` has to offer, we're going to work with a test string. We want to match the **address of a friend** with **multiple addresses from a phonebook** (yes, phonebooks are still a thing!):
@@ -363,6 +400,10 @@ for address in phonebook:
 # ---
 # [Go back to table of contents ^](#table)
 # # The verdict :
+# %%
+'''score_pairs gives every scorer for aligned pairs in one call, processing each string once for all scorers:'''
+score_pairs( pd.Series([friend_address] * len(phonebook)), pd.Series(phonebook), scorers=scorer_dict )
+
 # %% [markdown]
 # As we can see, the best performing scorer changes from an application to an other. In the case of comparing full names to emails, **fuzz.partial_ratio (PR)** is the way to go. For addresses, **fuzz.token_set_ratio (TSeR)** is the scorer that performed best, not only because it gave the highest ratio to the correct address, but because the difference between the ratios of the correct address and the closest wrong address is the highest (12 points).
 # 